@@ -0,0 +1,213 @@
+""" Runs a JSON Lines file of jobs on a pool of warm worker processes and writes one JSON result line per job
+
+A job is a JSON object with an "op" and its arguments, "id" is copied to the result (the line number if missing):
+    {"op": "parse", "entry": 0}                                    entry by index or key
+    {"op": "extract", "text": "...", "kind": "dialog"}             kind is "dialog" or "summary"
+    {"op": "kg", "entry": "key", "extractor": "chunk", "format": "png"}
+    {"op": "evaluate", "start": 0, "stop": 45, "in_memory": false}
+Every worker loads the corpus and the models once and keeps them for all of its jobs, consecutive extract jobs are
+parsed in one batch. Results are written in job order with the seconds each job took.
+"""
+
+import contextlib
+import io
+import json
+import multiprocessing
+import sys
+import time
+
+import ereengine
+import ereservice
+import evalindex
+import evaluate
+import generatekgs
+import parse
+
+CHUNK_SIZE = 16  # jobs sent to a worker at once, the extract jobs of a chunk share one parse
+OPS = ['parse', 'extract', 'kg', 'evaluate']
+
+_store = None
+_evaluation = None
+
+
+def get_store():
+    """ Returns the worker's corpus store, opened once """
+
+    global _store
+
+    if (_store is None):
+        _store = parse.load_store()
+    return _store
+
+
+def get_evaluation():
+    """ Returns the worker's (corpus, evaluation index, rarewords), built once """
+
+    global _evaluation
+
+    if (_evaluation is None):
+        data = get_store().load_all()
+        eval_index = evalindex.load(data)
+        _evaluation = (data, eval_index, evaluate.calc_rarewords(data, eval_index=eval_index))
+    return _evaluation
+
+
+def run_parse(job):
+    entry = get_store().load(job['entry'])
+    return {'key': entry.key, 'dialog': entry.dialog, 'summaries': entry.summaries,
+            'summaries_sentences': entry.summaries_sentences}
+
+
+def run_kg(job):
+    entry = get_store().load(job['entry'])
+    return generatekgs.generate_kgs_entry(entry, job.get('format', 'png'), True, job.get('extractor', 'chunk'))
+
+
+def run_evaluate(job):
+    data, eval_index, rarewords = get_evaluation()
+    # evaluate prints every summary, only the totals go to the result
+    with contextlib.redirect_stdout(io.StringIO()):
+        total_evaluated, total_correct, random_correct = evaluate.evaluate(
+            data, rarewords, job.get('start', 0), job.get('stop', len(data)), job.get('in_memory', False),
+            job.get('extractor', 'chunk'), job.get('weights'), eval_index=eval_index)
+    return {'count': total_evaluated, 'correct': total_correct, 'percent': total_correct / total_evaluated,
+            'random': random_correct / total_evaluated}
+
+
+RUNNERS = {'parse': run_parse, 'kg': run_kg, 'evaluate': run_evaluate}
+
+
+def error_message(e):
+    return type(e).__name__ + ': ' + str(e)
+
+
+def result(job, start, value=None, error=None):
+    """ Returns the result line of a job that started at start """
+
+    line = {'id': job.get('id'), 'op': job.get('op'), 'ok': error is None, 'seconds': time.perf_counter() - start}
+    if (error is None):
+        line['result'] = value
+    else:
+        line['error'] = error
+    return line
+
+
+def run_extracts(jobs):
+    """ Returns the results of extract jobs, the texts of each kind are parsed together """
+
+    results = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        if (not isinstance(job.get('text'), str)):
+            results[i] = result(job, time.perf_counter(), error='An extract job needs a "text" string')
+
+    for kind, rules in ereservice.RULES.items():
+        positions = [i for i, job in enumerate(jobs) if results[i] is None and job.get('kind', 'dialog') == kind]
+        if (len(positions) == 0):
+            continue
+        start = time.perf_counter()
+        texts_eres = ereengine.extract_texts_isolated([jobs[i]['text'] for i in positions], rules)
+        # the batch's time is shared by its jobs
+        seconds = (time.perf_counter() - start) / len(positions)
+        for i, eres in zip(positions, texts_eres):
+            if (isinstance(eres, Exception)):
+                results[i] = result(jobs[i], start, error=error_message(eres))
+            else:
+                results[i] = result(jobs[i], start, eres)
+            results[i]['seconds'] = seconds
+
+    for i, job in enumerate(jobs):
+        if (results[i] is None):
+            results[i] = result(job, time.perf_counter(), error='Unknown kind ' + str(job.get('kind')))
+    return results
+
+
+def run_chunk(jobs):
+    """ Runs a chunk of jobs in order, returns their result lines """
+
+    results = [None] * len(jobs)
+    extracts = [i for i, job in enumerate(jobs) if job.get('op') == 'extract']
+    for i, line in zip(extracts, run_extracts([jobs[i] for i in extracts])):
+        results[i] = line
+
+    for i, job in enumerate(jobs):
+        if (results[i] is not None):
+            continue
+        start = time.perf_counter()
+        if ('invalid' in job):
+            results[i] = result(job, start, error=job['invalid'])
+            continue
+        if (job.get('op') not in RUNNERS):
+            results[i] = result(job, start, error='Unknown op ' + str(job.get('op')) + ', expected one of ' +
+                                ', '.join(OPS))
+            continue
+        try:
+            results[i] = result(job, start, RUNNERS[job['op']](job))
+        except Exception as e:
+            results[i] = result(job, start, error=error_message(e))
+    return results
+
+
+def read_jobs(path):
+    """ Yields the jobs of a JSON Lines file, a job without an id gets its line number """
+
+    with open(path) as file:
+        for number, line in enumerate(file):
+            if (line.strip() == ''):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                job = {'invalid': 'Invalid JSON: ' + str(e)}
+            if (not isinstance(job, dict)):
+                job = {'invalid': 'A job must be a JSON object'}
+            job.setdefault('id', number)
+            yield job
+
+
+def chunks(jobs, size=CHUNK_SIZE):
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if (len(chunk) == size):
+            yield chunk
+            chunk = []
+    if (chunk):
+        yield chunk
+
+
+def run(jobs_path, results_path, processes=1, chunk_size=CHUNK_SIZE):
+    """ Runs every job of jobs_path, writes the result lines to results_path in job order, returns the job count """
+
+    # the store is brought up to date once before the workers open it
+    parse.load_store()
+    count = 0
+    start = time.perf_counter()
+    with open(results_path, 'w') as out:
+        if (processes > 1):
+            with multiprocessing.Pool(processes) as pool:
+                for lines in pool.imap(run_chunk, chunks(read_jobs(jobs_path), chunk_size)):
+                    for line in lines:
+                        out.write(json.dumps(line) + '\n')
+                    count += len(lines)
+        else:
+            for chunk in chunks(read_jobs(jobs_path), chunk_size):
+                for line in run_chunk(chunk):
+                    out.write(json.dumps(line) + '\n')
+                count += len(chunk)
+    print('Ran ' + str(count) + ' jobs in ' + str(round(time.perf_counter() - start, 3)) + ' seconds, results in "' +
+          results_path + '"')
+    return count
+
+
+if (__name__ == '__main__'):
+    processes = 1
+    if ('--processes' in sys.argv):
+        position = sys.argv.index('--processes')
+        processes = int(sys.argv[position + 1])
+        del sys.argv[position:position + 2]
+
+    if (len(sys.argv) != 3):
+        print("Please run command with a jobs file and a results file, EX: 'py batchrun.py jobs.jsonl results.jsonl"
+              " [--processes N]'")
+    else:
+        run(sys.argv[1], sys.argv[2], processes)
@@ -0,0 +1,300 @@
+""" Benchmarks every pipeline stage on data.json and on synthetic corpora scaled up from it
+
+Each scale gets its own workspace directory holding its data.json and every cache and artifact the pipeline
+writes, and each stage runs in a fresh process that starts with an empty Doc cache, so stages neither share
+warm caches nor memory. A stage reports its throughput, the p50/p95/p99 latency of its unit (one call for the
+whole-corpus stages, one text, graph, file or entry for the others) and the peak RSS of its process.
+Results are written as JSON and can be compared against a stored baseline, EX:
+    'py bench.py --scales 1,10 --save-baseline'    then after a change    'py bench.py --scales 1,10'
+"""
+
+import contextlib
+import copy
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+
+import numpy
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import depparser
+import doccache
+import evalindex
+import evaluate
+import generatekgs
+import parse
+import render
+import summ_depparser
+
+SCALES = [1, 10, 100]
+BENCH_PATH = 'bench'
+RESULTS_PATH = os.path.join(BENCH_PATH, 'results.json')
+BASELINE_PATH = 'bench_baseline.json'
+REPEAT = 3  # runs of the whole-corpus stages
+TOLERANCE = 0.10  # relative throughput loss or p95 growth reported as a regression
+# preprocessing passes in the order parse.preprocess runs them
+PARSE_PASSES = ['build_entries', 'replace_bad_words', 'clean_dialog', 'clean_summaries', 'coreference']
+STAGES = (['parse'] + ['parse.' + name for name in PARSE_PASSES] +
+          ['parse_dep', 'parse_summaries', 'generate_dot', 'generate_dot_depparser', 'render', 'evaluate'])
+# lowercase words that are not part of a contraction, the speaker and summary markers are never rewritten
+WORD_RE = re.compile(r"\b[a-z]{4,}\b(?!')")
+
+
+def synthesize(raw_entries, scale, seed=0):
+    """ Returns scale copies of the raw entries, every copy after the first one with its words permuted
+
+    A copy maps each word onto another word of the corpus, so its texts keep their length and word frequencies
+    but are new to the caches
+    """
+
+    vocabulary = sorted(set(word for entry in raw_entries for text in [entry['Dialog'], entry['Summary']]
+                            for word in WORD_RE.findall(text)))
+    entries = list(raw_entries)
+    for copy_num in range(1, scale):
+        shuffled = list(vocabulary)
+        random.Random(seed + copy_num).shuffle(shuffled)
+        mapping = dict(zip(vocabulary, shuffled))
+        rewrite = lambda text: WORD_RE.sub(lambda match: mapping[match.group(0)], text)
+        for entry in raw_entries:
+            entries.append({'key': entry['key'] + '-copy' + str(copy_num), 'Dialog': rewrite(entry['Dialog']),
+                            'Summary': rewrite(entry['Summary']), 'Summary_to_dialog': entry['Summary_to_dialog']})
+    return entries
+
+
+def workspace(scale):
+    """ Returns the workspace directory of a scale, writing its data.json on first use """
+
+    directory = os.path.abspath(os.path.join(BENCH_PATH, 'scale-' + str(scale)))
+    path = os.path.join(directory, parse.JSON_FILE_PATH)
+    if (not os.path.isfile(path)):
+        os.makedirs(directory, exist_ok=True)
+        with open(parse.JSON_FILE_PATH) as file:
+            raw_entries = json.load(file)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(synthesize(raw_entries, scale), file)
+        os.replace(path + '.tmp', path)
+    return directory
+
+
+def timed(function, *args):
+    """ Returns the seconds a call took """
+
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_parse():
+    latencies = []
+    for r in range(0, REPEAT):
+        doccache.clear()
+        latencies.append(timed(parse.parse, True))
+    return 'call', len(parse.parse()), latencies
+
+
+def bench_parse_pass(name):
+    """ Times one preprocessing pass on freshly built entries, the passes before it are not timed """
+
+    raw_entries = list(parse.iter_json(parse.JSON_FILE_PATH))
+    latencies = []
+    for r in range(0, REPEAT):
+        doccache.clear()
+        data = copy.deepcopy(raw_entries)
+        for earlier in PARSE_PASSES[:PARSE_PASSES.index(name)]:
+            data = getattr(parse, earlier)(data)
+        latencies.append(timed(getattr(parse, name), data))
+    return 'call', len(raw_entries), latencies
+
+
+def bench_parse_dep():
+    latencies = [timed(depparser.parse_dep, dialog) for entry in parse.parse() for dialog in entry.dialog]
+    return 'dialog turn', len(latencies), latencies
+
+
+def bench_parse_summaries():
+    latencies = [timed(summ_depparser.parse_summaries, summary) for entry in parse.parse()
+                 for summary in entry.summaries]
+    return 'summary', len(latencies), latencies
+
+
+def bench_generate_dot(name):
+    """ Times writing the conversation and summary KGs of every entry, the dot files are kept for render """
+
+    directory = os.path.join('bench_kgs', name)
+    os.makedirs(directory, exist_ok=True)
+    dialog_function = getattr(generatekgs, name)
+    summary_function = generatekgs.generate_dot_summdepparser if name == 'generate_dot_depparser' else dialog_function
+
+    latencies = []
+    for i, entry in enumerate(parse.parse()):
+        graphs = [(dialog_function, entry.dialog)] + [(summary_function, sentences)
+                                                      for sentences in entry.summaries_sentences]
+        for j, (function, list_) in enumerate(graphs):
+            path = os.path.join(directory, str(i) + '-' + str(j))
+            latencies.append(timed(function, list_, path + '.dot', path + '.txt'))
+    return 'graph', len(latencies), latencies
+
+
+def bench_render():
+    """ Times rendering the dot files of the generate_dot stage on the render pool """
+
+    directory = os.path.join('bench_kgs', 'generate_dot')
+    if (not os.path.isdir(directory)):
+        bench_generate_dot('generate_dot')
+    dot_paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.dot'))
+
+    latencies = []
+
+    def renderer(dot_path, out_path, format):
+        latencies.append(timed(render.render_dot, dot_path, out_path, format))
+
+    pool = render.RenderPool(renderer=renderer)
+    pool.render(dot_paths, 'png')
+    pool.close()
+    return 'file', len(dot_paths), latencies
+
+
+def bench_evaluate():
+    data = parse.parse()
+    eval_index = evalindex.load(data)
+    rarewords = evaluate.calc_rarewords(data, eval_index=eval_index)
+    # evaluate prints every summary
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = [timed(evaluate.evaluate_entry, entry, id, rarewords, False, 'chunk', None, None, eval_index)
+                     for id, entry in enumerate(data)]
+    return 'entry', len(latencies), latencies
+
+
+def peak_rss():
+    """ Returns the peak resident set size of this process in MB, None where it cannot be read """
+
+    if (resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def run_stage(directory, stage):
+    """ Runs a stage in a workspace, meant to be the only work of a fresh process """
+
+    os.chdir(directory)
+    doccache.clear()
+    if (stage.startswith('parse.')):
+        unit, items, latencies = bench_parse_pass(stage.split('.', 1)[1])
+    elif (stage in ['generate_dot', 'generate_dot_depparser']):
+        unit, items, latencies = bench_generate_dot(stage)
+    else:
+        unit, items, latencies = globals()['bench_' + stage]()
+
+    # a whole-corpus stage handles every item once per call
+    seconds = float(numpy.sum(latencies))
+    processed = items * len(latencies) if unit == 'call' else items
+    return {'stage': stage, 'unit': unit, 'items': items, 'samples': len(latencies), 'seconds': seconds,
+            'throughput': processed / seconds if seconds > 0 else None,
+            'p50': float(numpy.percentile(latencies, 50)) if latencies else None,
+            'p95': float(numpy.percentile(latencies, 95)) if latencies else None,
+            'p99': float(numpy.percentile(latencies, 99)) if latencies else None,
+            'peak_rss_mb': peak_rss()}
+
+
+def run(scales=None, stages=None):
+    """ Returns the result of every stage at every scale, each stage in its own process """
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for scale in scales or SCALES:
+        directory = workspace(scale)
+        for stage in stages or STAGES:
+            print('Scale ' + str(scale) + ' : ' + stage)
+            with context.Pool(1) as pool:
+                try:
+                    result = pool.apply(run_stage, (directory, stage))
+                except Exception as e:
+                    result = {'stage': stage, 'error': type(e).__name__ + ': ' + str(e)}
+            result['scale'] = scale
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """ Returns a line per stage found in both runs and whether any of them regressed """
+
+    base = {(result['scale'], result['stage']): result for result in baseline}
+    lines, regressed = [], False
+    for result in results:
+        old = base.get((result['scale'], result['stage']))
+        if (old is None or 'error' in result or 'error' in old or not result['throughput'] or
+                not old['throughput']):
+            continue
+        speedup = result['throughput'] / old['throughput']
+        p95_change = result['p95'] / old['p95'] if old['p95'] else 1.0
+        slower = speedup < 1 - tolerance or p95_change > 1 + tolerance
+        regressed = regressed or slower
+        lines.append(('REGRESSION ' if slower else '') + 'scale ' + str(result['scale']) + ' ' + result['stage'] +
+                     ' throughput x' + str(round(speedup, 3)) + ' p95 x' + str(round(p95_change, 3)))
+    return lines, regressed
+
+
+def report(results):
+    """ Prints a line per result """
+
+    for result in results:
+        if ('error' in result):
+            print('scale ' + str(result['scale']) + ' ' + result['stage'] + ' error: ' + result['error'])
+            continue
+        print('scale ' + str(result['scale']) + ' ' + result['stage'] + ' ' + str(result['items']) + ' items, ' +
+              str(round(result['throughput'] or 0, 2)) + ' items/s, p50/p95/p99 per ' + result['unit'] + ' ' +
+              '/'.join(str(round((result[p] or 0) * 1000, 2)) for p in ['p50', 'p95', 'p99']) + ' ms, peak ' +
+              str(round(result['peak_rss_mb'] or 0, 1)) + ' MB')
+
+
+if (__name__ == '__main__'):
+    options = {}
+    for flag in ['--scales', '--stages', '--output', '--baseline']:
+        if (flag in sys.argv):
+            position = sys.argv.index(flag)
+            options[flag] = sys.argv[position + 1]
+            del sys.argv[position:position + 2]
+    save_baseline = '--save-baseline' in sys.argv
+    if (save_baseline):
+        sys.argv.remove('--save-baseline')
+
+    unknown = [stage for stage in options.get('--stages', '').split(',') if stage and stage not in STAGES]
+    if (len(sys.argv) != 1 or unknown):
+        print("Please run command with optional scales, stages and files, EX: 'py bench.py --scales 1,10 "
+              "--stages parse,evaluate [--output bench/results.json] [--baseline bench_baseline.json] "
+              "[--save-baseline]', stages are " + ','.join(STAGES))
+    else:
+        scales = [int(scale) for scale in options['--scales'].split(',')] if '--scales' in options else None
+        stages = options['--stages'].split(',') if '--stages' in options else None
+        results = run(scales, stages)
+        report(results)
+
+        output = options.get('--output', RESULTS_PATH)
+        baseline_path = options.get('--baseline', BASELINE_PATH)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('Results saved to "' + output + '"')
+
+        if (save_baseline):
+            with open(baseline_path, 'w') as file:
+                json.dump(results, file, indent=2)
+            print('Baseline saved to "' + baseline_path + '"')
+        elif (os.path.isfile(baseline_path)):
+            with open(baseline_path) as file:
+                lines, regressed = compare(results, json.load(file))
+            for line in lines:
+                print(line)
+            if (regressed):
+                sys.exit(1)
@@ -1,10 +1,10 @@
 #import en_coref_md
-import spacy
 from nltk import CFG, ChartParser
+import nlpmodel
 import parse
 from parse import Entry
 
-nlp = spacy.load('en') # requires you to run 'python -m spacy download en'
+nlp = nlpmodel.load(disable=['ner'])
 #nlp2 = en_coref_md.load()
 data = parse.parse()
 
@@ -0,0 +1,223 @@
+""" Versioned on-disk store of preprocessed entries that can be read one entry at a time
+
+The store is a data file of concatenated pickled entries plus a JSON index holding the byte offset and
+source hash of each entry. Single entries are read through a memory map without loading the rest.
+Every update writes a new data file under a unique name and then replaces the index that names it, so the
+index on disk always matches its data file. A lock file serializes updates across processes.
+"""
+
+import contextlib
+import glob
+import json
+import mmap
+import os
+import pickle
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, updates are then not locked
+    fcntl = None
+
+STORE_VERSION = 2
+STORE_PATH = 'corpus'
+
+
+class CorpusStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock_path = os.path.join(path, 'lock')
+        self.data_path = None
+        self.index = None
+        self._positions = None
+        self._file = None
+        self._mmap = None
+
+        if (os.path.isfile(self.index_path)):
+            with self._lock(shared=True):
+                self._open()
+
+    @contextlib.contextmanager
+    def _lock(self, shared=False):
+        """ Holds the store's lock file, shared while opening the store and exclusive while updating it """
+
+        if (fcntl is None):
+            yield
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.lock_path, 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def _open(self):
+        """ Reads the index and opens the data file it names, called with the lock held """
+
+        self.close()
+        self.index, self.data_path, self._positions = None, None, None
+        if (not os.path.isfile(self.index_path)):
+            return
+        with open(self.index_path) as file:
+            index = json.load(file)
+        if (index.get('version') != STORE_VERSION):
+            return
+        data_path = os.path.join(self.path, index['data'])
+        if (os.path.isfile(data_path)):
+            # the open file stays readable even after a later update removes it
+            self._file = open(data_path, 'rb')
+            self.index, self.data_path = index, data_path
+
+    def exists(self):
+        """ Returns True if a store with the current version was found """
+
+        return self.index is not None
+
+    def is_current(self, source_hash, pipeline_hash):
+        """ Returns True if the store was written from the given source file and pipeline """
+
+        return (self.exists() and self.index['source'] == source_hash and
+                self.index['pipeline'] == pipeline_hash)
+
+    def __len__(self):
+        return len(self.index['entries']) if self.exists() else 0
+
+    def keys(self):
+        """ Returns the entry keys in corpus order """
+
+        return [record['key'] for record in self.index['entries']]
+
+    def position(self, id):
+        """ Returns the position of an entry given its index or key """
+
+        if (isinstance(id, int)):
+            if (id < 0 or id >= len(self)):
+                raise IndexError('Entry ' + str(id) + ' out of range (0,' + str(len(self) - 1) + ')')
+            return id
+        if (self._positions is None):
+            self._positions = {record['key']: i for i, record in enumerate(self.index['entries'])}
+        return self._positions[id]
+
+    def _bytes(self, record):
+        """ Returns the pickled bytes of an index record """
+
+        if (self._mmap is None):
+            if (self._file is None):
+                self._file = open(self.data_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[record['offset']:record['offset'] + record['length']]
+
+    def load(self, id):
+        """ Loads a single entry by index or key """
+
+        return pickle.loads(self._bytes(self.index['entries'][self.position(id)]))
+
+    def load_all(self):
+        """ Loads every entry in corpus order """
+
+        return [pickle.loads(self._bytes(record)) for record in self.index['entries']]
+
+    def close(self):
+        """ Releases the memory map of the data file """
+
+        if (self._mmap is not None):
+            self._mmap.close()
+        if (self._file is not None):
+            self._file.close()
+        self._mmap, self._file = None, None
+
+    def update(self, raw_entries, source_hash, pipeline_hash, process, refresh=False, batch_size=100):
+        """ Rewrites the store, reprocessing only the entries whose input changed, returns the reprocessed count
+
+        raw_entries yields (key, entry hash, raw entry) and process(raw entries, last subject) must return the
+        processed entries with their last_subject set, see parse.coreference. At most batch_size raw entries
+        are held in memory at once.
+        """
+
+        with self._lock():
+            # another process may have updated the store while this one waited for the lock
+            self._open()
+            if (not refresh and self.is_current(source_hash, pipeline_hash)):
+                return 0
+
+            old = {}
+            if (self.exists() and not refresh and self.index['pipeline'] == pipeline_hash):
+                old = {record['key']: record for record in self.index['entries']}
+
+            data_name = 'entries-' + uuid.uuid4().hex + '.dat'
+            data_path = os.path.join(self.path, data_name)
+            tmp_path = self.index_path + '.' + uuid.uuid4().hex + '.tmp'
+            try:
+                with open(data_path, 'wb') as out:
+                    records, reprocessed = self._write_entries(out, raw_entries, old, process, batch_size)
+                    out.flush()
+                    os.fsync(out.fileno())
+
+                # the index is replaced last, until then readers keep the previous index and data file
+                index = {'version': STORE_VERSION, 'source': source_hash, 'pipeline': pipeline_hash,
+                         'data': data_name, 'entries': records}
+                with open(tmp_path, 'w') as file:
+                    json.dump(index, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                for path in [data_path, tmp_path]:
+                    if (os.path.exists(path)):
+                        os.remove(path)
+                raise
+
+            self._open()
+            self._remove_stale()
+        return reprocessed
+
+    def _write_entries(self, out, raw_entries, old, process, batch_size):
+        """ Writes the unchanged old records and the reprocessed entries to out, returns (records, reprocessed) """
+
+        records, pending = [], []
+        last_subject = ''
+        reprocessed = 0
+        for key, entry_hash, raw in raw_entries:
+            record = old.get(key)
+            if (record is not None and record['hash'] == entry_hash):
+                # the last subject carried in from the previous entry must match as well
+                reprocessed += len(pending)
+                last_subject = self._write_processed(out, records, pending, process, last_subject)
+                if (record['last_subject_in'] == last_subject):
+                    records.append(dict(record, offset=out.tell()))
+                    out.write(self._bytes(record))
+                    last_subject = record['last_subject']
+                    continue
+            pending.append((key, entry_hash, raw))
+            if (len(pending) == batch_size):
+                reprocessed += len(pending)
+                last_subject = self._write_processed(out, records, pending, process, last_subject)
+
+        reprocessed += len(pending)
+        self._write_processed(out, records, pending, process, last_subject)
+        return records, reprocessed
+
+    def _remove_stale(self):
+        """ Removes the data and index files the current index does not name, called with the lock held """
+
+        for path in glob.glob(os.path.join(self.path, 'entries*.dat*')) + glob.glob(self.index_path + '.*.tmp'):
+            if (os.path.abspath(path) != os.path.abspath(self.data_path)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # still mapped by a reader on Windows, the next update retries
+                    pass
+
+    def _write_processed(self, out, records, pending, process, last_subject):
+        """ Processes the pending entries as one batch and appends them, returns the new last subject """
+
+        if (len(pending) == 0):
+            return last_subject
+
+        for (key, entry_hash, raw), entry in zip(pending, process([p[2] for p in pending], last_subject)):
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+            records.append({'key': key, 'hash': entry_hash, 'last_subject_in': last_subject,
+                            'last_subject': entry.last_subject, 'offset': out.tell(), 'length': len(data)})
+            out.write(data)
+            last_subject = entry.last_subject
+        del pending[:]
+        return last_subject
@@ -0,0 +1,154 @@
+""" Cache of parsed spaCy Docs, an in-memory LRU in front of an on-disk store keyed by text and model """
+
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+
+import spacy
+from spacy.tokens import Doc
+
+import nlpmodel
+
+CACHE_PATH = 'cache/docs.sqlite'
+MEMORY_SIZE = 20000  # number of Docs kept in the LRU layer
+
+_memory = collections.OrderedDict()
+_connection = None
+_connection_pid = None
+_lock = threading.RLock()
+
+
+def _connect():
+    """ Opens the on-disk store, creating it if needed """
+
+    global _connection, _connection_pid
+
+    # sqlite connections must not be shared with forked worker processes
+    if (_connection is None or _connection_pid != os.getpid()):
+        directory = os.path.dirname(CACHE_PATH)
+        if (directory != '' and not os.path.isdir(directory)):
+            os.makedirs(directory)
+        _connection = sqlite3.connect(CACHE_PATH, timeout=60, check_same_thread=False)
+        _connection_pid = os.getpid()
+        _connection.execute('CREATE TABLE IF NOT EXISTS docs (key TEXT PRIMARY KEY, data BLOB)')
+        _connection.commit()
+    return _connection
+
+
+def _model_id(nlp):
+    """ Identifies the model and the enabled pipeline components a Doc was parsed with """
+
+    return '|'.join([spacy.__version__, nlp.meta.get('lang', ''), nlp.meta.get('name', ''),
+                     nlp.meta.get('version', ''), ','.join(nlp.pipe_names)])
+
+
+def doc_key(text, model_id):
+    """ Returns the cache key of a text parsed with the given model """
+
+    return hashlib.sha1((model_id + '\n' + text).encode('utf-8')).hexdigest()
+
+
+def _remember(key, doc):
+    """ Adds a Doc to the LRU layer, evicting the least recently used Docs """
+
+    _memory[key] = doc
+    _memory.move_to_end(key)
+    while (len(_memory) > MEMORY_SIZE):
+        _memory.popitem(last=False)
+
+
+def _lookup(nlp, keys):
+    """ Returns a dict of key to Doc for every key found in memory or on disk """
+
+    found = {}
+    missing = []
+    with _lock:
+        for key in keys:
+            if (key in _memory):
+                _memory.move_to_end(key)
+                found[key] = _memory[key]
+            else:
+                missing.append(key)
+
+        if (len(missing) > 0):
+            connection = _connect()
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = connection.execute('SELECT key, data FROM docs WHERE key IN (' +
+                                          ','.join('?' * len(chunk)) + ')', chunk).fetchall()
+                for key, data in rows:
+                    doc = Doc(nlp.vocab).from_bytes(data)
+                    _remember(key, doc)
+                    found[key] = doc
+    return found
+
+
+def _store(docs):
+    """ Saves newly parsed Docs to memory and disk """
+
+    with _lock:
+        for key, doc in docs.items():
+            _remember(key, doc)
+        connection = _connect()
+        connection.executemany('INSERT OR REPLACE INTO docs VALUES (?, ?)',
+                               [(key, doc.to_bytes()) for key, doc in docs.items()])
+        connection.commit()
+
+
+def pipe(texts, disable=(), batch_size=nlpmodel.BATCH_SIZE, n_process=1, as_tuples=False):
+    """ Same as nlpmodel.pipe but only texts that are not cached get parsed """
+
+    nlp = nlpmodel.load(disable)
+    model_id = _model_id(nlp)
+
+    batch = []
+    for item in texts:
+        batch.append(item)
+        if (len(batch) == batch_size):
+            for result in _pipe_batch(nlp, model_id, batch, disable, batch_size, n_process, as_tuples):
+                yield result
+            batch = []
+
+    for result in _pipe_batch(nlp, model_id, batch, disable, batch_size, n_process, as_tuples):
+        yield result
+
+
+def _pipe_batch(nlp, model_id, batch, disable, batch_size, n_process, as_tuples):
+    """ Returns the Docs of one batch in input order, parsing the cache misses together """
+
+    texts = [item[0] for item in batch] if as_tuples else batch
+    keys = [doc_key(text, model_id) for text in texts]
+    found = _lookup(nlp, set(keys))
+
+    misses = collections.OrderedDict()
+    for key, text in zip(keys, texts):
+        if (key not in found and key not in misses):
+            misses[key] = text
+    if (len(misses) > 0):
+        parsed = nlpmodel.pipe(misses.values(), disable=disable, batch_size=batch_size, n_process=n_process)
+        parsed = collections.OrderedDict(zip(misses.keys(), parsed))
+        _store(parsed)
+        found.update(parsed)
+
+    if (as_tuples):
+        return [(found[key], item[1]) for key, item in zip(keys, batch)]
+    return [found[key] for key in keys]
+
+
+def parse(text, disable=()):
+    """ Returns the cached Doc of a single text """
+
+    return next(pipe([text], disable))
+
+
+def clear(memory_only=False):
+    """ Empties the LRU layer and, unless memory_only is set, the on-disk store """
+
+    with _lock:
+        _memory.clear()
+        if (not memory_only):
+            connection = _connect()
+            connection.execute('DELETE FROM docs')
+            connection.commit()
@@ -0,0 +1,125 @@
+""" spaCy document vectors of every dialog turn and summary sentence, cached on disk per entry
+
+evaluate's spaCy similarity score compares an ERE's summary sentence to each dialog turn. With the vectors of an
+entry stacked into matrices the comparison of every sentence to every turn is one matrix product, and the model
+only runs for entries whose text is not cached yet, all of them in a single nlp.pipe.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy
+import spacy
+
+import nlpmodel
+
+EMBEDDINGS_PATH = 'cache/embeddings'
+
+
+def model_id():
+    """ Identifies the model the vectors come from without loading it """
+
+    return spacy.__version__ + ' ' + nlpmodel.MODEL_NAME
+
+
+def embedding_path(entry):
+    """ Returns the cache file of an entry's vectors, addressed by the model and the entry's text """
+
+    content = json.dumps([model_id(), entry.dialog, entry.summaries_sentences])
+    return os.path.join(EMBEDDINGS_PATH, hashlib.sha1(content.encode('utf-8')).hexdigest() + '.npz')
+
+
+def vector_matrix(docs):
+    """ Stacks the vectors of Docs into a float32 matrix, a Doc without a vector gets a zero row """
+
+    vectors = [doc.vector for doc in docs]
+    width = max([len(vector) for vector in vectors] + [0])
+    matrix = numpy.zeros((len(vectors), width), dtype=numpy.float32)
+    for i, vector in enumerate(vectors):
+        if (len(vector) == width):
+            matrix[i] = vector
+    return matrix
+
+
+def save(path, turns, summaries):
+    """ Writes an entry's vectors next to the cache file and moves them in place once complete """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {'summary' + str(j): sentences for j, sentences in enumerate(summaries)}
+    with open(path + '.' + str(os.getpid()) + '.tmp', 'wb') as file:
+        numpy.savez(file, dialog=turns, **arrays)
+    os.replace(path + '.' + str(os.getpid()) + '.tmp', path)
+
+
+def load(path):
+    """ Reads the (turn vectors, [sentence vectors of each summary]) of a cache file """
+
+    with numpy.load(path) as arrays:
+        summaries = [arrays['summary' + str(j)] for j in range(0, len(arrays.files) - 1)]
+        return arrays['dialog'], summaries
+
+
+def entry_embeddings(entries):
+    """ Returns the (turn vectors, [sentence vectors of each summary]) of every entry
+
+    The entries missing from the cache are embedded together and saved
+    """
+
+    paths = [embedding_path(entry) for entry in entries]
+    missing = [i for i, path in enumerate(paths) if not os.path.isfile(path)]
+
+    if (len(missing) > 0):
+        texts = []
+        for i in missing:
+            texts += entries[i].dialog
+            for summary in entries[i].summaries_sentences:
+                texts += summary
+        matrix = vector_matrix(nlpmodel.pipe(texts))
+
+        position = 0
+        for i in missing:
+            turns = matrix[position:position + len(entries[i].dialog)]
+            position += len(turns)
+            summaries = []
+            for summary in entries[i].summaries_sentences:
+                summaries.append(matrix[position:position + len(summary)])
+                position += len(summary)
+            save(paths[i], turns, summaries)
+
+    return [load(path) for path in paths]
+
+
+def cosine(left, right):
+    """ Returns the cosine similarity of every row of left to every row of right, 0 where a vector is zero
+
+    Same as spaCy's Doc.similarity, which gives 0 for a Doc without a vector
+    """
+
+    left = numpy.asarray(left, dtype=numpy.float64)
+    right = numpy.asarray(right, dtype=numpy.float64)
+    if (left.shape[1] != right.shape[1]):
+        return numpy.zeros((len(left), len(right)))
+
+    left_norms = numpy.sqrt((left ** 2).sum(axis=1))
+    right_norms = numpy.sqrt((right ** 2).sum(axis=1))
+    norms = numpy.outer(left_norms, right_norms)
+    products = left.dot(right.T)
+    return numpy.divide(products, norms, out=numpy.zeros(products.shape), where=norms != 0)
+
+
+def similarities(entry):
+    """ Returns a sentence by dialog turn similarity matrix for each of the entry's summaries """
+
+    turns, summaries = entry_embeddings([entry])[0]
+    return [cosine(sentences, turns) for sentences in summaries]
+
+
+def sentence_values(similarity, triples):
+    """ Returns the similarity of each ERE's summary sentence to each dialog turn, one row per triple """
+
+    values = numpy.zeros((len(triples), similarity.shape[1]))
+    for e, ere in enumerate(triples):
+        if (int(ere[0]) < len(similarity)):
+            values[e] = similarity[int(ere[0])]
+    return values
@@ -0,0 +1,234 @@
+""" Rule-driven ERE extraction from dependency parses, shared by depparser and summ_depparser
+
+A rule set is plain data. Dependency labels are turned into the vocab's integer IDs once, so matching a token
+is an int set lookup. A subtree rule either keeps the listed dependencies ('keep') or every dependency that is
+not listed ('skip'). A kept token's children are visited, the children of a dropped token are not.
+"""
+
+import numpy
+from spacy.attrs import DEP, HEAD
+
+import doccache
+
+DIALOG_RULES = {
+    'name': 'dialog',
+    # children of the root that are joined into the relation
+    'relation': ["neg","prt"],
+    # children of the root that form the subject and component entities, or a new ERE
+    'subject': ["csubj","nsubj","xsubj","nsubjpass"],
+    'component': ["ccomp","xcomp","acomp","dobj","pobj","prep","pcomp"],
+    'new_ere': ["conj","advcl"],
+    # desired dependencies for the subtree of each kind of entity
+    'subject_subtree': {'keep': ["prep","pobj","dobj","csubj","nsubj","xsubj","compound","nsubjpass","oprd","relcl"]},
+    'component_subtree': {'keep': ["prep","pobj","dobj","csubj","nsubj","xsubj","advmod","pcomp","ccomp","neg","poss","compound","amod","nsubjpass","oprd","relcl"]},
+    'conjunction_subtree': {'keep': ["prep","pobj","dobj","csubj","nsubj","xsubj","relcl","amod","prt","neg","compound","nsubjpass","oprd","relcl"]},
+    # conjunctions of a component are taken from its direct children
+    'conjunctions': 'children',
+    # (dependency, lowercase word) pairs kept in any subtree
+    'keep_words': [("det","no")]
+}
+
+SUMMARY_RULES = {
+    'name': 'summary',
+    'relation': ["neg","prt"],
+    'subject': ["csubj","nsubj","xsubj","nsubjpass"],
+    'component': ["ccomp","xcomp","acomp","dobj","pobj","prep","pcomp"],
+    'new_ere': [],
+    #TODO: Find proper list of desired children for summaries
+    'subject_subtree': {'skip': ["conj","cc"]},
+    'component_subtree': {'skip': ["conj","cc"]},
+    'conjunction_subtree': {'skip': ["conj","cc"]},
+    # conjunctions of a component are taken from anywhere in its kept subtree
+    'conjunctions': 'subtree',
+    'keep_words': []
+}
+
+_compiled = {}
+
+
+class CompiledRules:
+    """ A rule set with every dependency label converted to the vocab's integer ID """
+
+    def __init__(self, rules, strings):
+        def ids(labels):
+            return frozenset(strings.add(label) for label in labels)
+
+        self.root = strings.add('ROOT')
+        self.conj = strings.add('conj')
+        self.relation = ids(rules['relation'])
+        self.subject = ids(rules['subject'])
+        self.component = ids(rules['component'])
+        self.new_ere = ids(rules['new_ere'])
+        self.subtrees = {}
+        for name in ['subject', 'component', 'conjunction']:
+            subtree = rules[name + '_subtree']
+            self.subtrees[name] = (ids(subtree['keep']) if 'keep' in subtree else None,
+                                   ids(subtree['skip']) if 'skip' in subtree else None)
+        self.conjunctions_in_subtree = rules['conjunctions'] == 'subtree'
+        self.keep_words = {}
+        for dep, word in rules['keep_words']:
+            self.keep_words.setdefault(strings.add(dep), set()).add(word)
+
+
+def compile_rules(rules, vocab):
+    """ Returns the compiled rules for a vocab, compiling them on first use """
+
+    key = (rules['name'], id(vocab))
+    if (key not in _compiled):
+        _compiled[key] = CompiledRules(rules, vocab.strings)
+    return _compiled[key]
+
+
+class DependencyTree:
+    """ Heads, labels and children of a parsed sentence as index lists, built once from the Doc's arrays """
+
+    def __init__(self, doc, rules):
+        array = doc.to_array([HEAD, DEP])
+        self.rules = rules
+        self.texts = [token.text for token in doc]
+        self.deps = array[:, 1].tolist()
+
+        # HEAD is stored as an unsigned offset from the token
+        heads = (numpy.arange(len(self.texts)) + array[:, 0].astype(numpy.int64)).tolist()
+        self.children = [[] for _ in self.texts]
+        self.root = None
+        for i, head in enumerate(heads):
+            if (head != i):
+                self.children[head].append(i)
+            if (self.deps[i] == rules.root):
+                self.root = i
+
+        self._subtrees = {}
+
+    def subtree(self, head, name):
+        """ Returns (tokens, conjunctions) of the head's entity under the named subtree rule
+
+        Tokens are collected in document preorder, conjunctions are the 'conj' tokens found below the entity
+        """
+
+        key = (head, name)
+        if (key not in self._subtrees):
+            keep, skip = self.rules.subtrees[name]
+            keep_words = self.rules.keep_words
+            entities, conjunctions = [head], []
+
+            stack = self.children[head][::-1]
+            while (stack):
+                i = stack.pop()
+                dep = self.deps[i]
+                if ((keep is not None and dep in keep) or (skip is not None and dep not in skip) or
+                        (dep in keep_words and self.texts[i].lower() in keep_words[dep])):
+                    entities.append(i)
+                    stack.extend(self.children[i][::-1])
+                elif (dep == self.rules.conj and self.rules.conjunctions_in_subtree):
+                    conjunctions.append(i)
+
+            if (not self.rules.conjunctions_in_subtree):
+                conjunctions = [c for c in self.children[head] if self.deps[c] == self.rules.conj]
+            self._subtrees[key] = (entities, conjunctions)
+        return self._subtrees[key]
+
+    def entity(self, head, name):
+        """ Joins the tokens of the head's entity in the order they show up in the sentence """
+
+        return ' '.join([self.texts[i] for i in sorted(self.subtree(head, name)[0])])
+
+    def relation(self, root):
+        """ Joins the root with its relation children, this forms the relation of the ERE """
+
+        rel = self.texts[root]
+        for child in self.children[root]:
+            if (self.deps[child] in self.rules.relation):
+                if (child < root):
+                    rel = self.texts[child] + " " + rel
+                else:
+                    rel = rel + " " + self.texts[child]
+        return rel
+
+    def eres(self, root):
+        """ Forms the EREs of a relation from the subjects, components and conjunctions among its children """
+
+        rules = self.rules
+        rel = self.relation(root)
+        subj_entity = None
+        comp_entity = None
+        conj_entities = []
+        new_eres = []
+
+        for child in self.children[root]:
+            dep = self.deps[child]
+            if (dep in rules.subject):
+                subj_entity = self.entity(child, 'subject')
+            if (dep in rules.component):
+                comp_entity = self.entity(child, 'component')
+                for conj in self.subtree(child, 'component')[1]:
+                    conj_entities.append(self.entity(conj, 'conjunction'))
+            if (dep in rules.new_ere):
+                # a conjunction without children forms no ERE
+                if (len(self.children[child]) > 0):
+                    new_eres = new_eres + self.eres(child)
+
+                # if conjunctions have no subject, inherit it
+                for idx, ere in enumerate(new_eres):
+                    if ere[0] == None:
+                        temp = new_eres.pop(idx)
+                        new_eres.append( (subj_entity, temp[1], temp[2]) )
+
+        ret = [(subj_entity, rel, comp_entity)]
+        for ent in conj_entities:
+            ret.append((subj_entity, rel, ent))
+        return ret + new_eres
+
+
+def extract(doc, rules):
+    """ Returns the EREs of a single parsed sentence, None if it has no ROOT """
+
+    tree = DependencyTree(doc, compile_rules(rules, doc.vocab))
+    if (tree.root is None):
+        return None
+    return tree.eres(tree.root)
+
+
+def extract_text(text, rules):
+    """ Returns the EREs of each '.' separated sentence of a text, stopping at the first sentence without a ROOT """
+
+    return extract_texts([text], rules)[0]
+
+
+def extract_texts(texts, rules):
+    """ Same as extract_text for many texts, the sentences of all of them are parsed in one batch """
+
+    sentences = [text.split('.') for text in texts]
+    docs = doccache.pipe([sentence for text_sentences in sentences for sentence in text_sentences], disable=['ner'])
+
+    texts_eres = []
+    for text_sentences in sentences:
+        text_eres = []
+        done = False
+        for sentence in text_sentences:
+            doc = next(docs)
+            sentence_eres = None if done else extract(doc, rules)
+            if (sentence_eres is None):
+                done = True
+            else:
+                text_eres.append(sentence_eres)
+        texts_eres.append(text_eres)
+    return texts_eres
+
+
+def extract_texts_isolated(texts, rules, extractor=extract_texts):
+    """ Same as extract_texts but a failing text only fails itself, returns the EREs or the exception of each text
+
+    The texts are parsed in one batch, if that raises each text is extracted alone
+    """
+
+    try:
+        return extractor(texts, rules)
+    except Exception:
+        results = []
+        for text in texts:
+            try:
+                results.append(extractor([text], rules)[0])
+            except Exception as e:
+                results.append(e)
+        return results
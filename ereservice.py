@@ -0,0 +1,206 @@
+""" Long-running ERE extraction service, keeps the spaCy model loaded and parses requests in micro-batches
+
+Texts that arrive while a batch is being collected are parsed together with one nlp.pipe. The service speaks
+JSON over HTTP (POST /eres) or over a Unix socket (one JSON object per line), a request is
+{"kind": "dialog" or "summary", "texts": [...]} and the reply {"eres": [EREs of each text], "error": false},
+with the same EREs depparser.parse_dep and summ_depparser.parse_summaries return.
+"""
+
+import concurrent.futures
+import http.server
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import ereengine
+
+RULES = {'dialog': ereengine.DIALOG_RULES, 'summary': ereengine.SUMMARY_RULES}
+MAX_BATCH_SIZE = 256  # texts parsed together at most
+MAX_WAIT = 0.005  # seconds a batch waits for more texts after its first one
+PORT = 8001
+SOCKET_PATH = 'cache/ereservice.sock'
+
+
+class ExtractionBatcher:
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT, extractor=ereengine.extract_texts):
+        """ extractor(texts, rules) returns the EREs of each text, it is only ever called from one thread """
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.extractor = extractor
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _collect(self):
+        """ Blocks for the first queued text, then takes more until the batch is full or max_wait has passed """
+
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while (batch[-1] is not None and len(batch) < self.max_batch_size):
+            timeout = deadline - time.monotonic()
+            if (timeout <= 0):
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while (True):
+            batch = self._collect()
+            stop = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+
+            for kind in RULES:
+                items = [(text, future) for text, item_kind, future in batch if item_kind == kind]
+                if (len(items) == 0):
+                    continue
+                for (text, future), eres in zip(items, ereengine.extract_texts_isolated(
+                        [text for text, future in items], RULES[kind], self.extractor)):
+                    if (isinstance(eres, Exception)):
+                        future.set_exception(eres)
+                    else:
+                        future.set_result(eres)
+
+            if (stop):
+                return
+
+    def submit(self, text, kind='dialog'):
+        """ Queues a text, returns a future of its EREs """
+
+        if (kind not in RULES):
+            raise ValueError('Unknown kind ' + str(kind) + ', expected one of ' + ', '.join(RULES))
+        future = concurrent.futures.Future()
+        self._queue.put((text, kind, future))
+        return future
+
+    def extract(self, texts, kind='dialog'):
+        """ Returns the EREs of each text, the texts are batched with those of concurrent callers """
+
+        return [future.result() for future in [self.submit(text, kind) for text in texts]]
+
+    def close(self):
+        """ Finishes the queued texts and stops the batching thread """
+
+        self._queue.put(None)
+        self._thread.join()
+
+
+def handle_request(batcher, request):
+    """ Returns the reply to a decoded JSON request """
+
+    try:
+        texts = request['texts'] if 'texts' in request else [request['text']]
+        # a string would pass as a list of one character texts
+        if (not isinstance(texts, list) or not all(isinstance(text, str) for text in texts)):
+            raise ValueError('texts must be a list of strings')
+        return {'eres': batcher.extract(texts, request.get('kind', 'dialog')), 'error': False}
+    except Exception as e:
+        return {'eres': [], 'error': True, 'message': str(e)}
+
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    batcher = None
+
+    def do_POST(self):
+        if (self.path != '/eres'):
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError:
+            request = {}
+        body = json.dumps(handle_request(self.batcher, request)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SocketHandler(socketserver.StreamRequestHandler):
+    batcher = None
+
+    def handle(self):
+        # a connection can send any number of requests, one JSON object per line
+        for line in self.rfile:
+            if (not line.strip()):
+                continue
+            try:
+                reply = handle_request(self.batcher, json.loads(line.decode('utf-8')))
+            except ValueError as e:
+                reply = {'eres': [], 'error': True, 'message': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def http_server(batcher, port=PORT):
+    """ Returns an HTTP server answering POST /eres on localhost """
+
+    handler = type('Handler', (HTTPHandler,), {'batcher': batcher})
+    return http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+def socket_server(batcher, path=SOCKET_PATH):
+    """ Returns a server answering JSON lines on a Unix socket, a stale socket file is replaced """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if (os.path.exists(path)):
+        os.remove(path)
+    handler = type('Handler', (SocketHandler,), {'batcher': batcher})
+    return ThreadingUnixServer(path, handler)
+
+
+def extract_remote(texts, kind='dialog', path=SOCKET_PATH):
+    """ Returns the EREs of each text from a running service's Unix socket """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        file = connection.makefile('rwb')
+        file.write(json.dumps({'kind': kind, 'texts': texts}).encode('utf-8') + b'\n')
+        file.flush()
+        reply = json.loads(file.readline().decode('utf-8'))
+    if (reply['error']):
+        raise ValueError(reply['message'])
+    return reply['eres']
+
+
+def serve(server, batcher):
+    """ Loads the model, then serves until interrupted """
+
+    # the first extraction loads the model, requests never wait for it
+    batcher.extract(['The service is ready.'])
+    print('Serving EREs on ' + str(server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if (__name__ == '__main__'):
+    if (len(sys.argv) == 3 and sys.argv[1] == '--port'):
+        batcher = ExtractionBatcher()
+        serve(http_server(batcher, int(sys.argv[2])), batcher)
+    elif (len(sys.argv) == 1 or (len(sys.argv) in [2, 3] and sys.argv[1] == '--socket')):
+        batcher = ExtractionBatcher()
+        serve(socket_server(batcher, sys.argv[2] if len(sys.argv) == 3 else SOCKET_PATH), batcher)
+    else:
+        print("Please run command with a port or a socket path, EX: 'py ereservice.py --port 8001'"
+              " or 'py ereservice.py --socket cache/ereservice.sock'")
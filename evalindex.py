@@ -0,0 +1,189 @@
+""" Persistent evaluation index of tokenized dialog turns, corpus token frequencies and per-entry TF-IDF matrices
+
+The arrays of every entry are concatenated into .npy files that are opened with memory mapping, a JSON file
+holds the vocabulary and the slice of each entry. Updating the index only re-tokenizes the entries whose
+dialog changed, see scorer.entry_arrays for what is stored per entry.
+"""
+
+import hashlib
+import json
+import os
+
+import nltk
+import numpy
+import scipy.sparse
+from nltk import word_tokenize
+
+import scorer
+
+INDEX_VERSION = 1
+INDEX_PATH = 'evalindex'
+# tokens are stored as vocabulary IDs, the sparse matrices as their data/indices/indptr arrays
+ARRAYS = ['terms', 'idfs', 'index_data', 'index_indices', 'index_indptr',
+          'counts_data', 'counts_indices', 'counts_indptr']
+TOKENIZER = 'nltk.word_tokenize ' + nltk.__version__
+
+
+def entry_hash(entry):
+    """ Returns a hash of everything the indexed arrays of an entry depend on """
+
+    return hashlib.sha1((TOKENIZER + '\n' + json.dumps(entry.dialog)).encode('utf-8')).hexdigest()
+
+
+class EvalIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.meta_path = os.path.join(path, 'index.json')
+        self.meta = None
+        self._arrays = {}
+        self._records = None
+
+        if (os.path.isfile(self.meta_path)):
+            with open(self.meta_path) as file:
+                meta = json.load(file)
+            if (meta.get('version') == INDEX_VERSION and meta.get('tokenizer') == TOKENIZER):
+                self.meta = meta
+
+    def exists(self):
+        """ Returns True if an index with the current version and tokenizer was found """
+
+        return self.meta is not None
+
+    def is_current(self, entries):
+        """ Returns True if the index holds exactly the given entries in their current state """
+
+        return (self.exists() and [[record['key'], record['hash']] for record in self.meta['entries']] ==
+                [[entry.key, entry_hash(entry)] for entry in entries])
+
+    def _array(self, name):
+        """ Returns a memory mapped array of the index """
+
+        if (name not in self._arrays):
+            self._arrays[name] = numpy.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def _slice(self, record, name):
+        start, stop = record['slices'][name]
+        return self._array(name)[start:stop]
+
+    def record(self, key):
+        """ Returns the index record of an entry key """
+
+        if (self._records is None):
+            self._records = {record['key']: record for record in self.meta['entries']}
+        return self._records[key]
+
+    def arrays(self, key):
+        """ Returns the (tokens, idfs, tfidf index, term counts) of an entry as built by scorer.entry_arrays """
+
+        record = self.record(key)
+        vocabulary = self.meta['vocabulary']
+        tokens = [vocabulary[id] for id in self._slice(record, 'terms').tolist()]
+        shape = (record['turns'], max(len(tokens), 1))
+        index = scipy.sparse.csr_matrix((self._slice(record, 'index_data'), self._slice(record, 'index_indices'),
+                                         self._slice(record, 'index_indptr')), shape=shape)
+        counts = scipy.sparse.csr_matrix((self._slice(record, 'counts_data'), self._slice(record, 'counts_indices'),
+                                          self._slice(record, 'counts_indptr')), shape=shape)
+        return tokens, self._slice(record, 'idfs'), index, counts
+
+    def scorer(self, entry, rarewords):
+        """ Returns the scorer.EntryScorer of an entry without tokenizing its dialog """
+
+        return scorer.EntryScorer(None, rarewords, self.arrays(entry.key))
+
+    def frequencies(self):
+        """ Returns a dict of token to its number of occurrences in the dialogs of the indexed corpus """
+
+        counts = self._array('frequencies').tolist()
+        return {token: count for token, count in zip(self.meta['vocabulary'], counts) if count > 0}
+
+    def rarewords(self, N=3):
+        """ Returns tokens that appear less or equal to N times, same as evaluate.calc_rarewords """
+
+        return set(token for token, count in self.frequencies().items() if count <= N)
+
+    def close(self):
+        """ Releases the memory maps of the arrays """
+
+        self._arrays = {}
+
+    def update(self, entries, refresh=False):
+        """ Rewrites the index for the given entries, returns how many of them had to be tokenized """
+
+        old = {}
+        vocabulary = []
+        if (self.exists() and not refresh):
+            old = {record['key']: record for record in self.meta['entries']}
+            vocabulary = list(self.meta['vocabulary'])
+        token_ids = {token: id for id, token in enumerate(vocabulary)}
+
+        arrays = {name: [] for name in ARRAYS}
+        sizes = {name: 0 for name in ARRAYS}
+        records = []
+        tokenized = 0
+        for entry in entries:
+            digest = entry_hash(entry)
+            record = old.get(entry.key)
+            if (record is not None and record['hash'] == digest):
+                parts = {name: numpy.array(self._slice(record, name)) for name in ARRAYS}
+                turns = record['turns']
+            else:
+                texts = [word_tokenize(dialog.lower()) for dialog in entry.dialog]
+                tokens, idfs, index, counts = scorer.entry_arrays(texts)
+                for token in tokens:
+                    if (token not in token_ids):
+                        token_ids[token] = len(vocabulary)
+                        vocabulary.append(token)
+                parts = {'terms': numpy.array([token_ids[token] for token in tokens], dtype=numpy.int64),
+                         'idfs': idfs, 'index_data': index.data, 'index_indices': index.indices,
+                         'index_indptr': index.indptr, 'counts_data': counts.data,
+                         'counts_indices': counts.indices, 'counts_indptr': counts.indptr}
+                turns = len(texts)
+                tokenized += 1
+
+            slices = {}
+            for name in ARRAYS:
+                arrays[name].append(parts[name])
+                slices[name] = [sizes[name], sizes[name] + len(parts[name])]
+                sizes[name] += len(parts[name])
+            records.append({'key': entry.key, 'hash': digest, 'turns': turns, 'slices': slices})
+
+        # corpus frequencies are summed from the stored term counts, nothing is tokenized for them
+        frequencies = numpy.zeros(len(vocabulary), dtype=numpy.int64)
+        for terms, counts_data, counts_indices in zip(arrays['terms'], arrays['counts_data'], arrays['counts_indices']):
+            numpy.add.at(frequencies, terms[counts_indices], counts_data)
+
+        dtypes = {'terms': numpy.int64, 'idfs': numpy.float64, 'index_data': numpy.float32,
+                  'index_indices': numpy.int32, 'index_indptr': numpy.int64, 'counts_data': numpy.int64,
+                  'counts_indices': numpy.int32, 'counts_indptr': numpy.int64}
+        columns = {name: numpy.concatenate([numpy.asarray(part, dtype=dtypes[name]) for part in arrays[name]] +
+                                           [numpy.zeros(0, dtype=dtypes[name])]) for name in ARRAYS}
+        columns['frequencies'] = frequencies
+
+        if (not os.path.isdir(self.path)):
+            os.makedirs(self.path)
+        self.close()
+        # without its JSON file a half written index is rebuilt instead of read
+        if (os.path.isfile(self.meta_path)):
+            os.remove(self.meta_path)
+        for name, column in columns.items():
+            # written next to the old file and moved in place once complete
+            with open(os.path.join(self.path, name + '.npy.tmp'), 'wb') as file:
+                numpy.save(file, column)
+            os.replace(os.path.join(self.path, name + '.npy.tmp'), os.path.join(self.path, name + '.npy'))
+
+        self.meta = {'version': INDEX_VERSION, 'tokenizer': TOKENIZER, 'vocabulary': vocabulary, 'entries': records}
+        self._records = None
+        with open(self.meta_path, 'w') as file:
+            json.dump(self.meta, file)
+        return tokenized
+
+
+def load(entries, path=INDEX_PATH):
+    """ Returns the evaluation index of the entries, building or updating it if it is not current """
+
+    index = EvalIndex(path)
+    if (not index.is_current(entries)):
+        tokenized = index.update(entries)
+        print('Evaluation index updated, tokenized ' + str(tokenized) + ' of ' + str(len(entries)) + ' entries')
+    return index
@@ -1,22 +1,34 @@
+import multiprocessing
 import sys
 from collections import Counter
 
 import gensim
 import nltk
-import spacy
 from gensim import models, similarities, summarization, utils
 from nltk import word_tokenize
 
+import embeddings
+import evalindex
 import generatekgs
+import kg
 import parse
+import scorer
 from parse import Entry
 
-nlp = spacy.load('en')
-print('Spacy loaded')
+# weights of the rarewords, tfidf and spacy similarity scores in make_ere_guess
+WEIGHTS = (.2, .8, 0)
+# points a sentence's dialog turn gets for each ERE guessing it, and the weights of the calc_labels bonuses
+VOTE_WEIGHT = 5
+LABEL_WEIGHTS = (1, 1)
+# 'numpy' scores EREs with the vectorized scorer module, 'gensim' with the original per ERE models
+ENGINE = 'numpy'
 
 
-def calc_rarewords(data, N=3):
-    """ Returns tokens that appear less or equal to N times"""
+def calc_rarewords(data, N=3, eval_index=None):
+    """ Returns tokens that appear less or equal to N times, read from the eval_index's frequencies if given """
+
+    if (eval_index is not None):
+        return eval_index.rarewords(N)
 
     # build global conversation token list
     tokens = []
@@ -29,14 +41,82 @@ def calc_rarewords(data, N=3):
     return rarewords
 
 
-def evaluate(data, rarewords, start, stop):
-    """ Calculates effectiveness of model using tfidf, rarewords, and S# labeling """
+def summary_graphs(entry, in_memory=False, extractor='chunk'):
+    """ Returns the KnowledgeGraphs of an Entry's five summaries
+
+    in_memory takes the EREs straight from the extractor, nothing is rendered or written to disk. Otherwise
+    the graphs are read from the cached KG artifacts, generating them if needed.
+    """
+
+    if (in_memory):
+        return [generatekgs.EXTRACTORS[extractor][1](entry.summaries_sentences[j]) for j in range(0, 5)]
+
+    # only the dot/txt artifacts are needed so nothing is rendered
+    kg_paths = generatekgs.generate_kgs_entry(entry, 'dot', extractor=extractor)
+    return [kg.load(generatekgs.graph_path(path)) for path in kg_paths[1:]]
+
+
+def evaluate(data, rarewords, start, stop, in_memory=False, extractor='chunk', weights=None, engine=None,
+             eval_index=None, processes=1):
+    """ Calculates effectiveness of model using tfidf, rarewords, and S# labeling
 
+    engine 'numpy' scores all EREs of a summary at once with scorer.EntryScorer, 'gensim' scores them one
+    at a time, both give the same guesses. With an evalindex.EvalIndex of the data the numpy engine reads each
+    entry's matrices from it instead of tokenizing the dialog. With processes > 1 the entries are evaluated on a
+    pool of worker processes, their results are merged in entry order so the output equals a serial run.
+    Returns (evaluated sentences, correct sentences, expected correct sentences of a random guess)
+    """
+
+    engine = engine or ENGINE
+    options = (in_memory, extractor, weights, engine)
+    ids = list(range(len(data)))[start:stop]
+
+    if ((weights or WEIGHTS)[2] != 0):
+        # embeds every entry missing from the cache in one batch
+        embeddings.entry_embeddings([data[id] for id in ids])
+
+    pool = None
+    if (processes > 1):
+        index_path = eval_index.path if eval_index is not None else None
+        pool = multiprocessing.Pool(processes, init_worker, (rarewords, options, index_path))
+        results = pool.imap(evaluate_worker, [(id, data[id]) for id in ids])
+    else:
+        results = (evaluate_entry(data[id], id, rarewords, *options, eval_index=eval_index) for id in ids)
+
+    # sums are taken in entry order, the same order a serial run adds them in
     total_evaluated, total_correct, random_correct = 0, 0.0, 0.0
+    try:
+        for lines, summaries, random_increments in results:
+            for line in lines:
+                print(line)
+            for sentence_count, sentence_correct in summaries:
+                total_evaluated += sentence_count
+                total_correct += sentence_correct
+            for random_increment in random_increments:
+                random_correct += random_increment
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+
+    print('--------------TOTAL RESULTS-------------')
+    print('count:' + str(total_evaluated) + ' correct:' +
+          str(total_correct) + ' percent:' + str(total_correct/total_evaluated) + ' random: ' + str(random_correct/total_evaluated))
+    return total_evaluated, total_correct, random_correct
+
 
-    for i, entry in enumerate(data[start:stop]):
-        generatekgs.generate_kgs(i)  # make sure graph files are for correct conversation
+def evaluate_entry(entry, id, rarewords, in_memory=False, extractor='chunk', weights=None, engine=None,
+                   eval_index=None):
+    """ Evaluates the five summaries of one entry
 
+    Returns (printed lines, (count, correct) of each summary, random guess score of each evaluated sentence)
+    """
+
+    engine = engine or ENGINE
+    lines, summaries, random_increments = [], [], []
+    graphs = summary_graphs(entry, in_memory, extractor)  # make sure graphs are for correct conversation
+
+    if (engine == 'gensim'):
         # build local conversation dict
         texts = []
         for dialog in entry.dialog:
@@ -53,95 +133,137 @@ def evaluate(data, rarewords, start, stop):
         # https://stackoverflow.com/questions/6255835/cosine-similarity-and-tf-idf
         tfidf = models.TfidfModel(corpus)
         index = similarities.SparseMatrixSimilarity(tfidf[corpus], num_features=dictionary.num_nnz)
+    elif (eval_index is not None):
+        entry_scorer = eval_index.scorer(entry, rarewords)
+    else:
+        entry_scorer = scorer.EntryScorer([list(word_tokenize(dialog.lower())) for dialog in entry.dialog],
+                                          rarewords)
+
+    # spacy similarity of every summary sentence to every dialog turn, only computed when it is weighted
+    spacy_weight = (weights or WEIGHTS)[2]
+    spacy_similarities = embeddings.similarities(entry) if spacy_weight != 0 else None
+
+    # label score/ label order score only depend on the entry
+    s1_s2_label_values, s1_s2_order_values = calc_labels(entry)
+    label_weight, order_weight = LABEL_WEIGHTS
+
+    lines.append('Entry : ' + str(id))
+    for j in range(0, 5):
+        triples = list(graphs[j].triples())  # triples come from the graph, no text needs to be split
+        ere_tokens = [tokenize_ere(ere) for ere in triples]
+        spacy_values = None
+        if (spacy_similarities is not None):
+            spacy_values = embeddings.sentence_values(spacy_similarities[j], triples)
+        if (engine != 'gensim'):
+            guesses = entry_scorer.guesses(ere_tokens, weights or WEIGHTS, spacy_values)
+
+        ere_count = 0
+        ere_guesses = Counter()
+        sentence_count, sentence_correct, unmatched_sentences = 0, 0.0, 0
+        for e, ere in enumerate(triples):
+            ere_num = str(ere[0])
+
+            if (str(sentence_count) != ere_num):  # done evaluating eres for a sentence
+                # sentence has no matches
+                if (str(sentence_count) not in entry.summary_to_dialog[1]):
+                    sentence_count += 1
+                    unmatched_sentences += 1
+                elif (ere_count > 0):
+                    for k in range(0, len(s1_s2_label_values)):
+                        ere_guesses[k] += (label_weight * s1_s2_label_values[k] +
+                                           order_weight * s1_s2_order_values[k])
+
+                    sentence_count, sentence_correct, random_increment = check_correct(
+                        entry, ere_guesses, sentence_count, sentence_correct, 0.0)
+                    random_increments.append(random_increment)
+                    ere_count = 0
+
+            if (engine == 'gensim'):
+                guess = gensim_guess(ere_tokens[e], entry, texts, dictionary, tfidf, index, rarewords, weights,
+                                     None if spacy_values is None else spacy_values[e])
+            else:
+                guess = guesses[e]
+            ere_guesses[str(guess)] += VOTE_WEIGHT
+            ere_count += 1
+        else:
+            # sentence has no matches
+            if (str(sentence_count) not in entry.summary_to_dialog[1]):
+                sentence_count += 1
+                unmatched_sentences += 1
+            elif (ere_count > 0):
+                for k in range(0, len(s1_s2_label_values)):
+                    ere_guesses[k] += (label_weight * s1_s2_label_values[k] +
+                                       order_weight * s1_s2_order_values[k])
+
+                sentence_count, sentence_correct, random_increment = check_correct(
+                    entry, ere_guesses, sentence_count, sentence_correct, 0.0)
+                random_increments.append(random_increment)
+                ere_count = 0
 
-        # run spacy on dialogs
-        # spacy_dialogs = [nlp(dialog) for dialog in entry.dialog]
+        # print results for single summary
+        sentence_count -= unmatched_sentences
+        percent = float('nan') if sentence_count == 0 else sentence_correct/sentence_count
+        lines.append('summary: ' + str(j) + ' count:' + str(sentence_count) + ' correct:' +
+                     str(sentence_correct) + ' percent:' + str(percent))
+        summaries.append((sentence_count, sentence_correct))
 
-        print('Entry : ' + str(i + start))
-        for j in range(0, 5):
-            with open('graphs/graph' + str(j) + '.txt', 'r') as csv_file:
-                ere_count = 0
-                ere_guesses = Counter()
-                sentence_count, sentence_correct, unmatched_sentences = 0, 0.0, 0
-                for ere in csv_file:
-                    ere_num = ere.split(',')[0]
-
-                    if (str(sentence_count) != ere_num):  # done evaluating eres for a sentence
-                        # sentence has no matches
-                        if (str(sentence_count) not in entry.summary_to_dialog[1]):
-                            sentence_count += 1
-                            unmatched_sentences += 1
-                        elif (ere_count > 0):
-                            # calc label score/ label order score
-                            s1_s2_label_values, s1_s2_order_values = calc_labels(
-                                entry)
-                            for k in range(0, len(s1_s2_label_values)):
-                                ere_guesses[k] += (s1_s2_label_values[k] + s1_s2_order_values[k])
-
-                            sentence_count, sentence_correct, random_correct = check_correct(
-                                entry, ere_guesses, sentence_count, sentence_correct, random_correct)
-                            ere_count = 0
-
-                    # make flat list of tokens from ere
-                    text = ere.split(',')[1:]
-                    tokens = [word_tokenize(str_.lower()) for str_ in text]
-                    tokens = [t for list_ in tokens for t in list_]
-
-                    # calc spacy raw string compare
-                    spacy_vals = [0] * len(entry.dialog)
-                    # sen_nlp = nlp(entry.summaries_sentences[j][int(ere_num)])
-                    # for k, dialog in enumerate(entry.dialog):
-                    #     spacy_vals[k] = sen_nlp.similarity(spacy_dialogs[k])
-
-                    # calc tfidf score
-                    sentence_vec = dictionary.doc2bow(tokens)
-                    sims = index[tfidf[sentence_vec]]
-                    largest = 1 if max(sims) == 0 else max(sims)
-                    tfidf_vals = [val / largest for val in sims]
-
-                    # calc rarewords score
-                    rarewords_values = [0] * len(entry.dialog)
-                    sentence_rares = set()
-                    for t in tokens:
-                        if t in rarewords:
-                            sentence_rares.add(t)
-                    for k, dialog in enumerate(texts):
-                        for token in dialog:
-                            if token in sentence_rares:
-                                rarewords_values[k] += 1
-                    largest = 1 if max(rarewords_values) == 0 else max(rarewords_values)
-                    rarewords_values = [val / largest for val in rarewords_values]
-
-                    guess = make_ere_guess(tfidf_vals, rarewords_values, spacy_vals)
-                    ere_guesses[str(guess)] += 5
-                    ere_count += 1
-                else:
-                    # sentence has no matches
-                    if (str(sentence_count) not in entry.summary_to_dialog[1]):
-                        sentence_count += 1
-                        unmatched_sentences += 1
-                    elif (ere_count > 0):
-                        s1_s2_label_values, s1_s2_order_values = calc_labels(
-                            entry)
-                        for k in range(0, len(s1_s2_label_values)):
-                            ere_guesses[k] += (s1_s2_label_values[k] + s1_s2_order_values[k])
-
-                        sentence_count, sentence_correct, random_correct = check_correct(
-                            entry, ere_guesses, sentence_count, sentence_correct, random_correct)
-                        ere_count = 0
-
-                # print results for single summary
-                sentence_count -= unmatched_sentences
-                percent = float('nan') if sentence_count == 0 else sentence_correct/sentence_count
-                print('summary: ' + str(j) + ' count:' + str(sentence_count) + ' correct:' +
-                      str(sentence_correct) + ' percent:' + str(percent))
+    return lines, summaries, random_increments
 
-                total_evaluated += sentence_count
-                total_correct += sentence_correct
 
-    print('--------------TOTAL RESULTS-------------')
-    print('count:' + str(total_evaluated) + ' correct:' +
-          str(total_correct) + ' percent:' + str(total_correct/total_evaluated) + ' random: ' + str(random_correct/total_evaluated))
+_worker = {}
+
+
+def init_worker(rarewords, options, index_path):
+    """ Keeps the arguments shared by every entry in a worker process """
+
+    _worker['rarewords'] = rarewords
+    _worker['options'] = options
+    _worker['eval_index'] = evalindex.EvalIndex(index_path) if index_path is not None else None
+
+
+def evaluate_worker(task):
+    """ Evaluates one (id, entry) task in a worker process """
+
+    id, entry = task
+    return evaluate_entry(entry, id, _worker['rarewords'], *_worker['options'], eval_index=_worker['eval_index'])
+
+
+def tokenize_ere(ere):
+    """ Makes a flat list of lowercase tokens from the entities and relation of an ERE triple """
+
+    tokens = [word_tokenize(str_.lower()) for str_ in ere[1:]]
+    return [t for list_ in tokens for t in list_]
+
+
+def gensim_guess(tokens, entry, texts, dictionary, tfidf, index, rarewords, weights=None, spacy_vals=None):
+    """ Guesses the dialog turn of a single ERE with the gensim TFIDF model and the rarewords counts
+
+    spacy_vals are the similarities of the ERE's summary sentence to each dialog turn, see embeddings
+    """
+
+    if (spacy_vals is None):
+        spacy_vals = [0] * len(entry.dialog)
+
+    # calc tfidf score
+    sentence_vec = dictionary.doc2bow(tokens)
+    sims = index[tfidf[sentence_vec]]
+    largest = 1 if max(sims) == 0 else max(sims)
+    tfidf_vals = [val / largest for val in sims]
+
+    # calc rarewords score
+    rarewords_values = [0] * len(entry.dialog)
+    sentence_rares = set()
+    for t in tokens:
+        if t in rarewords:
+            sentence_rares.add(t)
+    for k, dialog in enumerate(texts):
+        for token in dialog:
+            if token in sentence_rares:
+                rarewords_values[k] += 1
+    largest = 1 if max(rarewords_values) == 0 else max(rarewords_values)
+    rarewords_values = [val / largest for val in rarewords_values]
+
+    return make_ere_guess(tfidf_vals, rarewords_values, spacy_vals, weights)
 
 
 def calc_labels(entry):
@@ -172,13 +294,14 @@ def calc_labels(entry):
     return s1_s2_label_values, s1_s2_order_values
 
 
-def make_ere_guess(tfidf_values, rarewords_values, spacy_vals):
+def make_ere_guess(tfidf_values, rarewords_values, spacy_vals, weights=None):
     """ Make guess for given ere bassed on input and method weights"""
+    rarewords_weight, tfidf_weight, spacy_weight = weights or WEIGHTS
     guesses = [0] * len(tfidf_values)
     for i in range(0, len(guesses)):
-        guesses[i] += .2 * rarewords_values[i]
-        guesses[i] += .8 * tfidf_values[i]
-        guesses[i] += 0 * spacy_vals[i]
+        guesses[i] += rarewords_weight * rarewords_values[i]
+        guesses[i] += tfidf_weight * tfidf_values[i]
+        guesses[i] += spacy_weight * spacy_vals[i]
 
     return guesses.index(max(guesses))
 
@@ -210,10 +333,23 @@ def check_correct(entry, ere_guesses, sentence_count, sentence_correct, random_c
 
 
 if (__name__ == '__main__'):
+    # --in-memory evaluates EREs straight from the extractor without writing KG files
+    in_memory = '--in-memory' in sys.argv
+    if (in_memory):
+        sys.argv.remove('--in-memory')
+    # --processes N evaluates the entries on N worker processes
+    processes = 1
+    if ('--processes' in sys.argv):
+        position = sys.argv.index('--processes')
+        processes = int(sys.argv[position + 1])
+        del sys.argv[position:position + 2]
+
     if (len(sys.argv) != 3):
-        print("Please run command with desired conversation/summary range ID, EX: 'py evalaute.py 0 44'")
+        print("Please run command with desired conversation/summary range ID, EX: 'py evalaute.py 0 44 [--in-memory] [--processes N]'")
     elif (int(sys.argv[1]) < 0 or int(sys.argv[1]) > 45 or int(sys.argv[2]) < 0 or int(sys.argv[2]) > 45):
         print("Argument/s out of range (0,45)")
     else:
         data = parse.parse()
-        evaluate(data, calc_rarewords(data), int(sys.argv[1]), int(sys.argv[2]))
+        eval_index = evalindex.load(data)
+        evaluate(data, calc_rarewords(data, eval_index=eval_index), int(sys.argv[1]), int(sys.argv[2]), in_memory,
+                 eval_index=eval_index, processes=processes)
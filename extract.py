@@ -0,0 +1,68 @@
+""" Batched ERE extraction over the dialogs and summaries of many entries """
+
+import collections
+import sys
+import time
+
+import doccache
+import ereengine
+import nlpmodel
+import parse
+from parse import Entry
+
+
+def iter_sentences(entries):
+    """ Yields (unit, key, text) for every sentence of the given entries
+
+    key is (entry key, 'dialog', turn, sentence) for dialogs and (entry key, 'summary', summary, sentence)
+    for summaries, unit identifies the text whose sentences stop being parsed after the first one without a ROOT
+    """
+
+    for entry in entries:
+        for turn, dialog in enumerate(entry.dialog):
+            for num, sent in enumerate(dialog.split('.')):
+                yield (entry.key, 'dialog', turn), (entry.key, 'dialog', turn, num), sent
+
+        for summary, sentences in enumerate(entry.summaries_sentences):
+            for num, sentence in enumerate(sentences):
+                key = (entry.key, 'summary', summary, num)
+                for sent in sentence.split('.'):
+                    yield key, key, sent
+
+
+def extract_eres(entries, batch_size=nlpmodel.BATCH_SIZE, n_process=1):
+    """ Returns an ordered dict of sentence key to the EREs found in that sentence """
+
+    eres = collections.OrderedDict()
+    stopped = set()
+
+    texts = ((text, (unit, key)) for unit, key, text in iter_sentences(entries))
+    for doc, (unit, key) in doccache.pipe(texts, disable=['ner'], batch_size=batch_size,
+                                          n_process=n_process, as_tuples=True):
+        # same as parse_dep and parse_summaries, stop at the first sentence without a ROOT
+        if (unit in stopped):
+            continue
+
+        rules = ereengine.DIALOG_RULES if key[1] == 'dialog' else ereengine.SUMMARY_RULES
+        sentence_eres = ereengine.extract(doc, rules)
+
+        if (sentence_eres is None):
+            stopped.add(unit)
+        else:
+            eres.setdefault(key, []).extend(sentence_eres)
+
+    return eres
+
+
+if (__name__ == '__main__'):
+    if (len(sys.argv) > 3):
+        print("Please run command with optional batch size and process count, EX: 'py extract.py 1000 1'")
+    else:
+        batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else nlpmodel.BATCH_SIZE
+        n_process = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+        data = parse.parse()
+        start = time.time()
+        eres = extract_eres(data, batch_size, n_process)
+        print('Extracted EREs for ' + str(len(eres)) + ' sentences of ' + str(len(data)) +
+              ' entries in ' + str(round(time.time() - start, 2)) + 's')
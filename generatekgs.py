@@ -1,22 +1,42 @@
-import subprocess
+import collections
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
 import sys
+import tempfile
+import time
 
 import nltk
-import spacy
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
 import depparser
+import doccache
+import ereengine
+import kg
 import summ_depparser
 import parse
+import render
 from parse import Entry
 
 stop_words = set(stopwords.words('english'))
-nlp = spacy.load('en')  # requires you to run 'python -m spacy download en'
 
+# verbs with their surrounding determiners/adverbs are chinked out of the noun phrases and become the edges
+TAG_PATTERN = """NP: {<.*>+}
+                    }(<DT|RB.*|TO>?<VB.*>+<DT|RB.*|TO>?)+{
+                    VP: {(<DT|RB.*|TO>?<VB.*>+<DT|RB.*|TO>?)+}
+                """
+CHUNKER = nltk.RegexpParser(TAG_PATTERN)
 
-def build_KG(nltk_tree, graph_file, text_file, sentence_count=0):
-    """ Takes a nltk.tree.Tree object and generates a GraphViz file """
+# 'nltk' re-tags spaCy's tokens with nltk.pos_tag, 'spacy' reuses the Penn tags of the cached parse
+TAGGER = 'nltk'
+
+
+def build_KG(nltk_tree, graph, sentence_count=0):
+    """ Takes a nltk.tree.Tree object and adds its NP -> VP -> NP triples to the KnowledgeGraph """
 
     left = ''
     edge = ''
@@ -28,7 +48,7 @@ def build_KG(nltk_tree, graph_file, text_file, sentence_count=0):
                 left += '_'.join(token[0] for token in node)
             else:
                 right = '_'.join(token[0] for token in node)
-                write_triple(left, edge, right, graph_file, text_file, sentence_count)
+                graph.add_triple(left, edge, right, sentence_count)
 
                 left = right
                 edge = ''
@@ -39,141 +59,258 @@ def build_KG(nltk_tree, graph_file, text_file, sentence_count=0):
                 edge += '_'.join(token[0] for token in node)
 
 
-def write_triple(left, edge, right, graph_file, text_file, sentence_num):
-    """ Writes a node edge triple to the graphviz file"""
+def add_eres(graph, eres, sentence_num):
+    """ Adds (subject, relation, component) EREs to the KnowledgeGraph, a missing entity becomes the '' node """
+
+    for ere in eres:
+        graph.add_triple(ere[0] or "", ere[1], ere[2] or "", sentence_num)
+
+
+def tag_sentences(docs, tagger=None):
+    """ Returns the (word, Penn tag) pairs of each parsed sentence using the given tagger """
+
+    tagger = tagger or TAGGER
+    if (tagger == 'spacy'):
+        return [[(token.text, token.tag_) for token in doc] for doc in docs]
+    if (tagger == 'nltk'):
+        return nltk.pos_tag_sents([[token.text for token in doc] for doc in docs])
+    raise ValueError('Unknown tagger ' + str(tagger))
+
 
-    # node_name [label="node name"]
-    graph_file.write('"' + left +
-                     '"' + ' [label="' + left.replace('_', ' ') + '"];\n')
-    graph_file.write('"' + right.replace('/', '').replace('\\', '') +
-                     '"' + ' [label="' + right.replace('_', ' ') + '"];\n')
-    # node_1 -> node_2 [label="edge name"]
-    graph_file.write('"' + left + '"' + ' -> '
-                     + '"' + right + '"' + ' [label="' + edge.replace('_', ' ') + '"];\n')
-    text_file.write(str(sentence_num) + ',' + left.replace('_', ' ') + ',' +
-                    edge.replace('_', ' ') + ',' + right.replace('_', ' ') + '\n')
+def chunk_sentences(list_, tagger=None):
+    """ Returns the NP/VP chunk tree of each sentence, the sentences are parsed and tagged as one batch """
 
+    docs = list(doccache.pipe(list_, disable=['ner']))
+    return [CHUNKER.parse(tagged) for tagged in tag_sentences(docs, tagger)]
 
-def generate_dot(list_, graph_file_path, text_file):
+
+def chunk_graph(list_, tagger=None):
+    """ Builds the KnowledgeGraph of a single summary or conversation using chinking/chunking """
+
+    graph = kg.KnowledgeGraph()
+    for sentence_dialog_count, chunked in enumerate(chunk_sentences(list_, tagger)):
+        build_KG(chunked, graph, sentence_dialog_count)
+        # chunked.draw()
+    return graph
+
+
+def generate_dot(list_, graph_file_path, text_file, tagger=None):
     """ Creates dot file for a single summary or conversation """
 
-    with open(graph_file_path, 'w') as graph_file, open(text_file, 'w') as text_file:
-        graph_file.write('digraph Summary {\n')
-        sentence_dialog_count = 0
-        for sentence_or_dialog in list_:
-            doc = nlp(sentence_or_dialog)
+    graph = chunk_graph(list_, tagger)
+    kg.save(graph, graph_file_path)
+    kg.save(graph, text_file)
+
+
+def chunks(tree):
+    """ Returns the (label, words) chunks of a chunk tree, this is what build_KG turns into triples """
 
-            tokens = []
-            for token in doc:
-                tokens.append(token.text)
+    return [(node.label(), tuple(token[0] for token in node)) for node in tree]
 
-            text = nltk.pos_tag(tokens)
-            tag_pattern = """NP: {<.*>+}
-                                }(<DT|RB.*|TO>?<VB.*>+<DT|RB.*|TO>?)+{
-                                VP: {(<DT|RB.*|TO>?<VB.*>+<DT|RB.*|TO>?)+}
-                            """
 
-            regexp_pattern = nltk.RegexpParser(tag_pattern)
-            chunked = regexp_pattern.parse(text)
-            build_KG(chunked, graph_file, text_file, sentence_dialog_count)
-            # chunked.draw()
+def compare_taggers(entries):
+    """ Chunks every dialog and summary sentence with both taggers, prints the agreement and the speedup """
 
-            sentence_dialog_count += 1
+    sentences = []
+    for entry in entries:
+        sentences += entry.dialog
+        for summary in entry.summaries_sentences:
+            sentences += summary
+    docs = list(doccache.pipe(sentences, disable=['ner']))
 
-        graph_file.write('}')
+    results, seconds = {}, {}
+    for tagger in ['nltk', 'spacy']:
+        start = time.time()
+        results[tagger] = [chunks(CHUNKER.parse(tagged)) for tagged in tag_sentences(docs, tagger)]
+        seconds[tagger] = time.time() - start
 
+    same = sum(1 for a, b in zip(results['nltk'], results['spacy']) if a == b)
+    print('Identical chunks for ' + str(same) + ' of ' + str(len(docs)) + ' sentences')
+    print('nltk: ' + str(round(seconds['nltk'], 2)) + 's, spacy: ' + str(round(seconds['spacy'], 2)) +
+          's, speedup ' + str(round(seconds['nltk'] / max(seconds['spacy'], 1e-9), 1)) + 'x')
 
-def generate_kgs(id):
-    """ Generates KGs using chinking/chunking """
 
-    data = parse.parse()
+def depparser_graph(list_):
+    """ Builds the KnowledgeGraph of a conversation using the dependency parser """
 
-    generate_dot(data[id].dialog, 'graphs/graph_convo.dot', 'graphs/graph_convo.txt')
-    # requires ~graphviz-2.38\release\bin to be in PATH
-    subprocess.run(['dot', '-Tpng', 'graphs/graph_convo.dot', '-o', 'graphs/graph_convo.png'])
+    graph = kg.KnowledgeGraph()
+    for sentence_dialog_count, dialog in enumerate(list_):
+        for eres in depparser.parse_dep(dialog):
+            add_eres(graph, eres, sentence_dialog_count)
+    return graph
 
-    for count in range(0, 5):
-        graph_name = 'graphs/graph' + str(count)
 
-        # generate graphviz file
-        generate_dot(data[id].summaries_sentences[count], graph_name + '.dot', graph_name + '.txt')
+def summdepparser_graph(list_):
+    """ Builds the KnowledgeGraph of a summary using the dependency parser """
 
-        # requires ~graphviz-2.38\release\bin to be in PATH
-        subprocess.run(['dot', '-Tpng', graph_name + '.dot', '-o', graph_name + '.png'])
+    graph = kg.KnowledgeGraph()
+    for sentence_dialog_count, summ in enumerate(list_):
+        for eres in summ_depparser.parse_summaries(summ):
+            add_eres(graph, eres, sentence_dialog_count)
+    return graph
 
 
 def generate_dot_depparser(list_, graph_file_path, text_file):
     """ Generates KGs using dependency parser """
 
-    with open(graph_file_path, 'w') as graph_file, open(text_file, 'w') as text_file:
-        graph_file.write('digraph Summary {\n')
-
-        sentence_dialog_count = 0
-        for dialog in list_:
-            parsed = depparser.parse_dep(dialog)
-            for eres in parsed:
-                for ere in eres:
-                    if (ere[0] is None and ere[2] is None):
-                        write_triple("", ere[1], "", graph_file, text_file, sentence_dialog_count)
-                    elif ere[0] is None:
-                        write_triple("", ere[1], ere[2], graph_file,
-                                     text_file, sentence_dialog_count)
-                    elif ere[2] is None:
-                        write_triple(ere[0], ere[1], "", graph_file,
-                                     text_file, sentence_dialog_count)
-                    else:
-                        write_triple(ere[0], ere[1], ere[2], graph_file,
-                                     text_file, sentence_dialog_count)
-            sentence_dialog_count += 1
-
-        graph_file.write('}')
+    graph = depparser_graph(list_)
+    kg.save(graph, graph_file_path)
+    kg.save(graph, text_file)
 
 
 def generate_dot_summdepparser(list_, graph_file_path, text_file):
-    with open(graph_file_path, 'w') as graph_file, open(text_file, 'w') as text_file:
-        graph_file.write('digraph Summary {\n')
+    graph = summdepparser_graph(list_)
+    kg.save(graph, graph_file_path)
+    kg.save(graph, text_file)
+
+
+# dialog and summary graph builders of each extractor
+EXTRACTORS = {
+    'chunk': (chunk_graph, chunk_graph),
+    'depparse': (depparser_graph, summdepparser_graph)
+}
+# every graph is saved in each of these formats, .kg is what evaluate reads back
+SAVED_FORMATS = ['.dot', '.txt', '.kg']
+GRAPH_NAMES = ['graph_convo'] + ['graph' + str(count) for count in range(0, 5)]
+KG_PATH = 'graphs'
+
+_extractor_hashes = {}
+
+
+def extractor_hash(extractor):
+    """ Returns a hash of the preprocessing pipeline and of everything the extractor's output depends on """
+
+    if (extractor not in _extractor_hashes):
+        sha = hashlib.sha1((parse.pipeline_hash() + extractor + TAGGER + TAG_PATTERN).encode('utf-8'))
+        functions = [build_KG, add_eres, tag_sentences, chunk_sentences, write_dots] + list(EXTRACTORS[extractor])
+        for function in functions:
+            sha.update(inspect.getsource(function).encode('utf-8'))
+        sha.update(inspect.getsource(kg).encode('utf-8'))
+        if (extractor == 'depparse'):
+            for module in [ereengine, depparser, summ_depparser]:
+                sha.update(inspect.getsource(module).encode('utf-8'))
+        _extractor_hashes[extractor] = sha.hexdigest()
+    return _extractor_hashes[extractor]
+
+
+def kg_directory(entry, extractor='chunk'):
+    """ Returns the content-addressed directory of an entry's KG artifacts """
+
+    key = re.sub('[^A-Za-z0-9_.-]', '_', entry.key)
+    # the entry's text is part of the address too, an edited conversation keeps its key
+    content = json.dumps([entry.dialog, entry.summaries_sentences])
+    version = hashlib.sha1((extractor_hash(extractor) + content).encode('utf-8')).hexdigest()
+    return os.path.join(KG_PATH, key, extractor + '-' + version[:16])
+
+
+def text_path(path):
+    """ Returns the path of the ERE text file written next to a KG artifact """
+
+    return os.path.splitext(path)[0] + '.txt'
+
+
+def graph_path(path):
+    """ Returns the path of the binary KnowledgeGraph written next to a KG artifact """
+
+    return os.path.splitext(path)[0] + '.kg'
+
+
+def write_dots(entry, build_dialog, build_summary, directory):
+    """ Saves the KGs of a conversation and its five summaries, returns the dot file paths """
+
+    graph_names = [os.path.join(directory, name) for name in GRAPH_NAMES]
+    graphs = [build_dialog(entry.dialog)] + [build_summary(entry.summaries_sentences[count])
+                                             for count in range(0, 5)]
+
+    for graph_name, graph in zip(graph_names, graphs):
+        for extension in SAVED_FORMATS:
+            kg.save(graph, graph_name + extension)
+
+    return [graph_name + '.dot' for graph_name in graph_names]
+
+
+def cached_dots(entry, extractor='chunk'):
+    """ Returns the dot file paths of an entry's KGs, the files are only written if they are not cached yet """
+
+    directory = kg_directory(entry, extractor)
+    if (not os.path.isdir(directory)):
+        # written to a private directory and moved in place, a concurrent writer never sees partial files
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix='.tmp-')
+        renamed = False
+        try:
+            write_dots(entry, EXTRACTORS[extractor][0], EXTRACTORS[extractor][1], tmp_directory)
+            os.rename(tmp_directory, directory)
+            renamed = True
+        except OSError:
+            # another request cached the same artifacts first
+            if (not os.path.isdir(directory)):
+                raise
+        finally:
+            # a failed extractor or a lost race leaves no partial directory behind
+            if (not renamed):
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    return [os.path.join(directory, name + '.dot') for name in GRAPH_NAMES]
+
+
+def render_dots(dot_paths, format='png', wait=True, pool=None):
+    """ Renders dot files concurrently on the render pool, returns the output paths or their futures
+
+    Outputs that were rendered before are not rendered again
+    """
+
+    pool = pool or render.get_pool()
+    futures = []
+    for dot_path in dot_paths:
+        if (os.path.isfile(render.output_path(dot_path, format))):
+            futures.append(render.done(render.output_path(dot_path, format)))
+        else:
+            futures.append(pool.submit(dot_path, format))
+    return render.wait(futures) if wait else futures
+
+
+def generate_kgs(id, format='png', wait=True, extractor='chunk'):
+    """ Generates KGs using chinking/chunking, returns the cached artifact paths of the conversation and summaries """
+
+    return generate_kgs_entry(parse.load_entry(id), format, wait, extractor)
+
+
+def generate_kgs_entry(entry, format='png', wait=True, extractor='chunk'):
+    """ Same as generate_kgs for an already loaded Entry """
+
+    return render_dots(cached_dots(entry, extractor), format, wait)
+
 
-        sentence_dialog_count = 0
-        for summ in list_:
-            parsed = summ_depparser.parse_summaries(summ)
-            for eres in parsed:
-                for ere in eres:
-                    if (ere[0] is None and ere[2] is None):
-                        write_triple("", ere[1], "", graph_file, text_file, sentence_dialog_count)
-                    elif ere[0] is None:
-                        write_triple("", ere[1], ere[2], graph_file,
-                                     text_file, sentence_dialog_count)
-                    elif ere[2] is None:
-                        write_triple(ere[0], ere[1], "", graph_file,
-                                     text_file, sentence_dialog_count)
-                    else:
-                        write_triple(ere[0], ere[1], ere[2], graph_file,
-                                     text_file, sentence_dialog_count)
-            sentence_dialog_count += 1
+def cached_kgs(entry, format='png', extractor='chunk'):
+    """ Returns the artifact paths of an entry's KGs if all of them are generated and rendered, else None """
 
-        graph_file.write('}')
+    directory = kg_directory(entry, extractor)
+    paths = [render.output_path(os.path.join(directory, name + '.dot'), format) for name in GRAPH_NAMES]
+    return paths if all(os.path.isfile(path) for path in paths) else None
 
 
-def generate_kgs_depparser(id):
-    data = parse.parse()
+def generate_kgs_depparser(id, format='png', wait=True):
+    return generate_kgs(id, format, wait, 'depparse')
 
-    generate_dot_depparser(data[id].dialog, 'graphs/graph_convo.dot', 'graphs/graph_convo.txt')
-    # requires ~graphviz-2.38\release\bin to be in PATH
-    subprocess.run(['dot', '-Tpng', 'graphs/graph_convo.dot', '-o', 'graphs/graph_convo.png'])
 
-    for count in range(0, 5):
-        graph_name = 'graphs/graph' + str(count)
+def generate_kgs_batch(ids, extractor='chunk', format='png'):
+    """ Generates the KGs of many conversations, rendering all of them on one pool
 
-        # generate graphviz file
-        generate_dot_summdepparser(data[id].summaries_sentences[count],
-                                   graph_name + '.dot', graph_name + '.txt')
+    The dot files of a conversation are queued as soon as they are written, so rendering overlaps with
+    generating the next conversation. Returns a dict of id to artifact paths.
+    """
 
-        # requires ~graphviz-2.38\release\bin to be in PATH
-        subprocess.run(['dot', '-Tpng', graph_name + '.dot', '-o', graph_name + '.png'])
+    futures = collections.OrderedDict()
+    for id in ids:
+        futures[id] = generate_kgs(id, format, False, extractor)
+    return collections.OrderedDict((id, render.wait(f)) for id, f in futures.items())
 
 
 if (__name__ == '__main__'):
-    if (len(sys.argv) != 2):
+    if (len(sys.argv) == 2 and sys.argv[1] == '--compare-taggers'):
+        compare_taggers(parse.parse())
+    elif (len(sys.argv) != 2):
         print("Please run command with desired conversation/summary ID, EX: 'py generatekgs.py 0'")
     elif (int(sys.argv[1]) < 0 or int(sys.argv[1]) > 44):
         print("Argument out of range (0,44)")
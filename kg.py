@@ -0,0 +1,128 @@
+""" Knowledge graph built from ERE triples, with interned nodes and the sentence each edge came from
+
+Nodes are stored once no matter how many triples use them, names keep the '_' joined tokens of the chunker
+and labels show them with spaces. The graph can be written as dot, CSV, JSON or a compact binary file.
+"""
+
+import csv
+import json
+import pickle
+
+BINARY_VERSION = 1
+
+
+class KnowledgeGraph:
+    def __init__(self, name='Summary'):
+        self.name = name
+        self.nodes = []  # node names, a node's ID is its position
+        self.node_ids = {}
+        self.edges = []  # (left ID, edge label, right ID, sentence number)
+
+    def node(self, name):
+        """ Returns the ID of a node, adding it on first use """
+
+        id = self.node_ids.get(name)
+        if (id is None):
+            id = self.node_ids[name] = len(self.nodes)
+            self.nodes.append(name)
+        return id
+
+    def add_triple(self, left, edge, right, sentence_num):
+        """ Adds a node edge triple found in the given sentence """
+
+        self.edges.append((self.node(left), edge.replace('_', ' '), self.node(right), sentence_num))
+
+    def triples(self):
+        """ Yields (sentence number, left label, edge label, right label) in the order the triples were added """
+
+        for left, edge, right, sentence_num in self.edges:
+            yield sentence_num, label(self.nodes[left]), edge, label(self.nodes[right])
+
+    def write_dot(self, file):
+        """ Writes the graph as a GraphViz digraph, every node is declared once """
+
+        file.write('digraph ' + self.name + ' {\n')
+        for name in self.nodes:
+            # node_name [label="node name"]
+            file.write(quote(name) + ' [label=' + quote(label(name)) + '];\n')
+        for left, edge, right, sentence_num in self.edges:
+            # node_1 -> node_2 [label="edge name"]
+            file.write(quote(self.nodes[left]) + ' -> ' + quote(self.nodes[right]) +
+                       ' [label=' + quote(edge) + '];\n')
+        file.write('}')
+
+    def write_csv(self, file):
+        """ Writes one 'sentence,left,edge,right' row per triple, fields with commas or quotes are escaped """
+
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerows(self.triples())
+
+    def to_json(self):
+        """ Returns the graph as a JSON serializable dict """
+
+        return {'name': self.name, 'nodes': self.nodes, 'edges': [list(edge) for edge in self.edges]}
+
+    def to_bytes(self):
+        """ Returns the graph as compact binary data, see from_bytes """
+
+        return pickle.dumps((BINARY_VERSION, self.name, self.nodes, self.edges), pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_json(cls, data):
+        graph = cls(data['name'])
+        for name in data['nodes']:
+            graph.node(name)
+        graph.edges = [tuple(edge) for edge in data['edges']]
+        return graph
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, name, nodes, edges = pickle.loads(data)
+        if (version != BINARY_VERSION):
+            raise ValueError('Unsupported knowledge graph version ' + str(version))
+        graph = cls(name)
+        for node in nodes:
+            graph.node(node)
+        graph.edges = edges
+        return graph
+
+
+def label(name):
+    """ Returns the displayed label of a node name """
+
+    return name.replace('_', ' ')
+
+
+def quote(text):
+    """ Quotes a dot ID or label """
+
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def save(graph, path):
+    """ Writes a graph in the format given by the file extension, .dot, .txt/.csv, .json or .kg """
+
+    if (path.endswith('.kg')):
+        with open(path, 'wb') as file:
+            file.write(graph.to_bytes())
+        return
+
+    with open(path, 'w', newline='' if path.endswith(('.txt', '.csv')) else None) as file:
+        if (path.endswith('.dot')):
+            graph.write_dot(file)
+        elif (path.endswith(('.txt', '.csv'))):
+            graph.write_csv(file)
+        elif (path.endswith('.json')):
+            json.dump(graph.to_json(), file)
+        else:
+            raise ValueError('Unknown knowledge graph format ' + path)
+
+
+def load(path):
+    """ Reads a graph saved as .kg or .json """
+
+    if (path.endswith('.kg')):
+        with open(path, 'rb') as file:
+            return KnowledgeGraph.from_bytes(file.read())
+    with open(path) as file:
+        return KnowledgeGraph.from_json(json.load(file))
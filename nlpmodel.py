@@ -0,0 +1,46 @@
+""" Process-wide spaCy model registry, the model is loaded once on first use and shared by every module """
+
+import copy
+import threading
+
+import spacy
+
+MODEL_NAME = 'en'  # requires you to run 'python -m spacy download en'
+BATCH_SIZE = 1000
+
+_nlp = None
+_views = {}
+_lock = threading.Lock()
+
+
+def load(disable=()):
+    """ Return the shared spaCy model with the given pipeline components disabled """
+
+    global _nlp
+
+    disable = tuple(sorted(disable))
+    with _lock:
+        if (_nlp is None):
+            print('Loading spaCy model "' + MODEL_NAME + '"')
+            _nlp = spacy.load(MODEL_NAME)
+
+        if (disable not in _views):
+            if (len(disable) == 0):
+                _views[disable] = _nlp
+            else:
+                # shallow copy shares the vocab and component weights, only the pipeline list differs
+                view = copy.copy(_nlp)
+                view.pipeline = [(name, proc) for name, proc in _nlp.pipeline if name not in disable]
+                _views[disable] = view
+
+        return _views[disable]
+
+
+
+def pipe(texts, disable=(), batch_size=BATCH_SIZE, n_process=1, as_tuples=False):
+    """ Streams texts through the shared model in batches, n_process > 1 requires spaCy 2.2+ """
+
+    nlp = load(disable)
+    if (n_process == 1):
+        return nlp.pipe(texts, batch_size=batch_size, as_tuples=as_tuples)
+    return nlp.pipe(texts, batch_size=batch_size, as_tuples=as_tuples, n_process=n_process)
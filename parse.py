@@ -1,16 +1,27 @@
 """ Parses the nldslab json into a custom formatted object """
 
 import collections
+import functools
+import hashlib
+import inspect
 import json
+import multiprocessing
 import os
-import pickle
 import re
 import sys
 
 import spacy
 from nltk.tokenize import sent_tokenize, word_tokenize
 
+import corpusstore
+import doccache
+import nlpmodel
+import normalize
+import replacer
+
 JSON_FILE_PATH = 'data.json'
+STREAM_BATCH_SIZE = 100  # raw entries preprocessed together when streaming
+SHARD_SIZE = 10  # raw entries sent to a worker at once when preprocessing in parallel
 
 REPLACE_DICT = {
     "don't": "do not",
@@ -48,6 +59,12 @@ REPLACE_DICT = {
     "and/or": "either or both"
 }
 
+REPLACE_FILES = []  # extra dictionaries merged over REPLACE_DICT, see replacer.load_dictionary
+REPLACE_ENGINE = 'trie'  # see replacer.ENGINES
+
+_store = None
+_store_key = None
+
 
 class Entry:
     def __init__(self, key, dialog, summary, summary_to_dialog):
@@ -65,24 +82,128 @@ class Entry:
                 self.summary_to_dialog[i][sen].add(dialog)
 
 
-def parse(refresh=False):
+def parse(refresh=False, processes=1):
     """ Return Entry object list with preprocessed text """
 
-    if (not refresh):
-        if (os.path.isfile('./parse.p')):
-            print('Reading data from saved object file "parse.p" pass boolean to force refresh')
-            return pickle.load(open('./parse.p', 'rb'))
-        else:
-            print('Saved data obj "parse.p" does not exist, refreshing')
-            return parse(True)
+    return load_store(refresh, processes).load_all()
+
+
+def load_entry(id):
+    """ Return a single preprocessed Entry by index or key without loading the rest of the corpus """
+
+    return load_store().load(id)
+
+
+def load_store(refresh=False, processes=1):
+    """ Return the corpus store, reprocessing only the entries whose input or preprocessing changed
+
+    The opened store is kept for the process and only validated again once data.json or the replacement
+    settings change
+    """
+
+    global _store, _store_key
+
+    stat = os.stat(JSON_FILE_PATH)
+    key = (os.path.abspath(corpusstore.STORE_PATH), os.path.abspath(JSON_FILE_PATH), stat.st_mtime_ns, stat.st_size,
+           REPLACE_ENGINE, tuple(REPLACE_FILES))
+    if (not refresh and _store is not None and _store_key == key):
+        return _store
+    if (_store is not None):
+        _store.close()
+    _store, _store_key = None, None
+
+    store = corpusstore.CorpusStore()
+    source = file_hash(JSON_FILE_PATH)
+    pipeline = pipeline_hash()
+
+    if (not refresh and store.is_current(source, pipeline)):
+        print('Reading data from saved corpus store "' + store.path + '" pass boolean to force refresh')
+        _store, _store_key = store, key
+        return store
+
+    print('Saved corpus store "' + store.path + '" is missing or out of date, refreshing')
+    raw_entries = ((entry['key'], entry_hash(entry), entry) for entry in iter_json(JSON_FILE_PATH))
+    if (processes == 1):
+        count = store.update(raw_entries, source, pipeline, preprocess, refresh, STREAM_BATCH_SIZE)
     else:
-        with open(JSON_FILE_PATH) as file:
-            data = json.load(file)
-            entries = []
-            for entry in data:
-                entries.append(
-                    Entry(entry['key'], entry['Dialog'], entry['Summary'], entry['Summary_to_dialog']))
+        # every worker loads the model once when it starts
+        with multiprocessing.Pool(processes, nlpmodel.load, (['ner'],)) as pool:
+            count = store.update(raw_entries, source, pipeline, functools.partial(preprocess_parallel, pool=pool),
+                                 refresh, STREAM_BATCH_SIZE * processes)
+
+    print('Reprocessed ' + str(count) + ' of ' + str(len(store)) + ' entries, saved to "' + store.path + '"')
+    _store, _store_key = store, key
+    return store
+
+
+def parse_stream(path=JSON_FILE_PATH, batch_size=STREAM_BATCH_SIZE):
+    """ Yield preprocessed Entry objects one at a time, only batch_size raw entries are held in memory """
+
+    last_subject = ''
+    batch = []
+    for entry in iter_json(path):
+        batch.append(entry)
+        if (len(batch) == batch_size):
+            for processed in preprocess(batch, last_subject):
+                last_subject = processed.last_subject
+                yield processed
+            batch = []
+
+    for processed in preprocess(batch, last_subject):
+        yield processed
+
+
+def iter_json(path, chunk_size=1 << 16):
+    """ Yield the raw entries of a json array or json lines file without reading the whole file """
+
+    decoder = json.JSONDecoder()
+    with open(path) as file:
+        buffer = file.read(chunk_size).lstrip()
+        is_array = buffer.startswith('[')
+        if (is_array):
+            buffer = buffer[1:]
+        eof = False
+
+        while (True):
+            buffer = buffer.lstrip()
+            if (is_array and buffer.startswith(',')):
+                buffer = buffer[1:].lstrip()
+            if (is_array and buffer.startswith(']')):
+                return
+
+            try:
+                if (buffer == ''):
+                    raise ValueError('Buffer is empty')
+                entry, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # entry is cut off at the end of the buffer, read more of the file
+                if (eof):
+                    if (buffer == '' and not is_array):
+                        return
+                    raise
+                more = file.read(chunk_size)
+                eof = more == ''
+                buffer += more
+                continue
+
+            yield entry
+            buffer = buffer[end:]
+
+
+def build_entries(data):
+    """ Builds Entry objects from raw json entries """
+
+    entries = []
+    for entry in data:
+        entries.append(
+            Entry(entry['key'], entry['Dialog'], entry['Summary'], entry['Summary_to_dialog']))
+    return entries
+
+
+def preprocess(data, last_subject=''):
+    """ Builds Entry objects from raw json entries and runs every preprocessing pass on them """
 
+    entries = build_entries(data)
     entries = replace_bad_words(entries)
     # count_bad_words(entries)
 
@@ -90,15 +211,64 @@ def parse(refresh=False):
     entries = clean_summaries(entries)
 
     # comment this out to run coreference.py
-    entries = coreference(entries)
-
-    if (refresh):
-        print('Saving data object to "parse.p"')
-        pickle.dump(entries, open('./parse.p', 'wb'))
+    entries = coreference(entries, last_subject)
 
     return entries
 
 
+def preprocess_parallel(data, last_subject='', pool=None, shard_size=SHARD_SIZE):
+    """ Same output as preprocess, shards of entries are cleaned and parsed across the pool's worker processes """
+
+    shards = [data[i:i + shard_size] for i in range(0, len(data), shard_size)]
+    entries, actions = [], []
+    # imap returns the shards in input order
+    for shard_entries, shard_actions in pool.imap(preprocess_shard, shards):
+        entries += shard_entries
+        actions += shard_actions
+
+    # summary subjects carry over between entries so this pass stays serial
+    return apply_coreference(entries, actions, last_subject)
+
+
+def preprocess_shard(data):
+    """ Runs every pass except applying summary subjects on a shard of raw entries, used by worker processes """
+
+    entries = build_entries(data)
+    entries = replace_bad_words(entries)
+    entries = clean_dialog(entries)
+    entries = clean_summaries(entries)
+    return entries, coreference_actions(entries)
+
+
+def file_hash(path):
+    """ Returns the sha1 of a file's contents """
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def entry_hash(entry):
+    """ Returns the sha1 of a raw json entry """
+
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def pipeline_hash():
+    """ Returns a hash of everything besides the raw entry that changes the preprocessed output """
+
+    sha = hashlib.sha1((json.dumps(replacement_dict(), sort_keys=True) + REPLACE_ENGINE).encode('utf-8'))
+    for function in [Entry, build_entries, preprocess, replace_bad_words, clean_dialog, clean_summaries,
+                     coreference, coreference_actions, subject_action, apply_coreference]:
+        sha.update(inspect.getsource(function).encode('utf-8'))
+    for module in [normalize, replacer]:
+        sha.update(inspect.getsource(module).encode('utf-8'))
+    sha.update((spacy.__version__ + nlpmodel.MODEL_NAME).encode('utf-8'))
+    return sha.hexdigest()
+
+
 def count_bad_words(data):
     """ Counts number of words contaning ' and / which are split by SpaCy """
 
@@ -121,68 +291,87 @@ def count_bad_words(data):
     print(counter.most_common())
 
 
-def replace_bad_words(data):
+def replace_bad_words(data, engine=None):
     """ Replace words in text based on REPLACE_DICT """
 
-    # http://code.activestate.com/recipes/81330-single-pass-multiple-replace/
-    regex = re.compile("(%s)" % "|".join(map(re.escape, REPLACE_DICT.keys())))
+    replace = replacer.build(replacement_dict(), engine or REPLACE_ENGINE).replace
 
     for entry in data:
-        entry.dialog = regex.sub(
-            lambda rbw: REPLACE_DICT[rbw.string[rbw.start():rbw.end()]], entry.dialog)
-        entry.summaries = regex.sub(
-            lambda rbw: REPLACE_DICT[rbw.string[rbw.start():rbw.end()]], entry.summaries)
+        entry.dialog = replace(entry.dialog)
+        entry.summaries = replace(entry.summaries)
 
     return data
 
 
-def coreference(data):
-    """ Removes ambiguous pronouns from data """
+def replacement_dict():
+    """ Returns REPLACE_DICT with the dictionaries in REPLACE_FILES merged over it """
+
+    mapping = dict(REPLACE_DICT)
+    for path in REPLACE_FILES:
+        mapping.update(replacer.load_dictionary(path))
+    return mapping
+
+
+def coreference(data, last_subject=''):
+    """ Removes ambiguous pronouns from data, last_subject carries the summary subject in from earlier entries """
+
+    return apply_coreference(data, coreference_actions(data), last_subject)
+
+
+def coreference_actions(data):
+    """ Replaces dialog pronouns and finds the subject action of every summary sentence, needs no earlier entries """
+
+    # parse every summary sentence of the corpus in one batch
+    for entry in data:
+        entry.summaries_sentences = [list(summaries) for summaries in entry.summaries_sentences]
+    docs = doccache.pipe([doc for entry in data for summaries in entry.summaries_sentences for doc in summaries],
+                         disable=['ner'])
 
-    nlp = spacy.load('en')
-    stored = ''
+    actions = []
     for entry in data:
-        for line, dialog in enumerate(entry.dialog):
-            if line % 2 == 0:
-                entry.dialog[line] = entry.dialog[line].replace('You ', 'S2 ')
-                entry.dialog[line] = entry.dialog[line].replace('you ', 'S2 ')
-                entry.dialog[line] = entry.dialog[line].replace('I ', 'S1 ')
-                entry.dialog[line] = entry.dialog[line].replace(' Me ', ' S1 ')
-                entry.dialog[line] = entry.dialog[line].replace(' me ', ' S1 ')
+        entry.dialog = [normalize.replace_pronouns(dialog, line) for line, dialog in enumerate(entry.dialog)]
+        actions.append([[subject_action(next(docs)) for sentence in summaries]
+                        for summaries in entry.summaries_sentences])
+    return actions
+
+
+def subject_action(sentence):
+    """ Returns ('store', subject) or ('replace', pronoun) for a parsed summary sentence, None if neither applies """
+
+    for idx, word in enumerate(sentence):
+        if word.dep_ == 'compound':
+            return ('store', word.text)
+        elif word.text == "This":
+            if sentence[idx + 1].text == 'person':
+                return ('replace', word.text + ' ' + sentence[idx + 1].text)
+        elif word.dep_ == 'nsubj':
+            if word.text == 'They' or word.text == 'He' or word.text == 'She':
+                if sentence[idx + 1].text == 'or' and sentence[idx + 2].dep_ is 'conj':
+                    return ('replace', word.text + ' ' + sentence[idx + 1].text + ' ' + sentence[idx + 2].text)
+                return ('replace', word.text)
             else:
-                entry.dialog[line] = entry.dialog[line].replace('You ', 'S1 ')
-                entry.dialog[line] = entry.dialog[line].replace('you ', 'S1 ')
-                entry.dialog[line] = entry.dialog[line].replace('I ', 'S2 ')
-                entry.dialog[line] = entry.dialog[line].replace(' Me ', ' S2 ')
-                entry.dialog[line] = entry.dialog[line].replace(' me ', ' S2 ')
-        for count, summaries in enumerate(entry.summaries_sentences):
-            summaries = list(entry.summaries_sentences[count])
-            for num, doc in enumerate(summaries):
-                sentence = nlp(doc)
-                for idx, word in enumerate(sentence):
-                    if word.dep_ == 'compound':
-                        stored = word.text
-                        break
-                    elif word.text == "This":
-                        if sentence[idx + 1].text == 'person':
-                            summaries[num] = summaries[num].replace(
-                                word.text + ' ' + sentence[idx + 1].text, stored, 1)
-                            break
-                    elif word.dep_ == 'nsubj':
-                        if word.text == 'They' or word.text == 'He' or word.text == 'She':
-                            if sentence[idx + 1].text == 'or' and sentence[idx + 2].dep_ is 'conj':
-                                summaries[num] = summaries[num].replace(
-                                    word.text + ' ' + sentence[idx + 1].text + ' ' + sentence[idx + 2].text, stored, 1)
-                                break
-                            summaries[num] = summaries[num].replace(word.text, stored, 1)
-                            break
-                        else:
-                            stored = word.text
-                            if sentence[idx + 1].text == 'and' and sentence[idx + 2].dep_ is 'conj':
-                                stored += ' ' + sentence[idx + 1].text + \
-                                    ' ' + sentence[idx + 2].text
-                            break
-            entry.summaries_sentences[count] = summaries
+                stored = word.text
+                if sentence[idx + 1].text == 'and' and sentence[idx + 2].dep_ is 'conj':
+                    stored += ' ' + sentence[idx + 1].text + \
+                        ' ' + sentence[idx + 2].text
+                return ('store', stored)
+    return None
+
+
+def apply_coreference(data, actions, last_subject=''):
+    """ Replaces summary pronouns with the last stored subject, this pass has to run in corpus order """
+
+    stored = last_subject
+    for entry, entry_actions in zip(data, actions):
+        for summaries, summary_actions in zip(entry.summaries_sentences, entry_actions):
+            for num, action in enumerate(summary_actions):
+                if (action is None):
+                    continue
+                elif (action[0] == 'store'):
+                    stored = action[1]
+                else:
+                    summaries[num] = summaries[num].replace(action[1], stored, 1)
+        entry.last_subject = stored
     return data
 
 
@@ -205,35 +394,23 @@ def clean_dialog(data):
     """ Split dialog by speaker and remove exteraneous tokens"""
 
     for entry in data:
-        # split dialog by speaker and remove special characters
-        entry.dialog = re.sub(r'\([^)]*\)', '', entry.dialog)  # remove everything between ()'s
-        entry.dialog = re.sub('[?!]', '.', entry.dialog)  # change all punction to periods
-        entry.dialog = re.sub('\.+', '.', entry.dialog)  # change '..' or longer
-        entry.dialog = [re.sub('[/\\-"()]', '',  str_).strip()
-                        for str_ in re.split('S[0-9]:[0-9]+-', entry.dialog)[1:]]
-
-        # remove sentences shorter than 6 words
-        for i, dialog in enumerate(entry.dialog):
-            new_dialog = ''
-            for sentence in dialog.split('.'):
-                if len(sentence.split(' ')) >= 6:
-                    new_dialog += sentence + '.'
-            entry.dialog[i] = new_dialog
-
-        entry.dialog_raw = [re.sub('\s+', ' ', str_).strip()
-                            for str_ in re.split('S[0-9]:[0-9]+-', entry.dialog_raw)[1:]]
+        # split dialog by speaker, remove special characters and sentences shorter than 6 words
+        entry.dialog = normalize.clean_dialog(entry.dialog)
+        entry.dialog_raw = normalize.clean_dialog_raw(entry.dialog_raw)
 
     return data
 
 
 if (__name__ == '__main__'):
-    if (len(sys.argv) != 2):
-        print("Please run command with desired conversation/summary ID, EX: 'py parse.py 0'")
+    if (len(sys.argv) in [2, 3] and sys.argv[1] == '--refresh'):
+        parse(True, int(sys.argv[2]) if len(sys.argv) == 3 else 1)
+    elif (len(sys.argv) != 2):
+        print("Please run command with desired conversation/summary ID, EX: 'py parse.py 0'"
+              " or rebuild the corpus store with a process count, EX: 'py parse.py --refresh 8'")
     elif (int(sys.argv[1]) < 0 or int(sys.argv[1]) > 44):
         print("Argument out of range (0,44)")
     else:
-        data = parse(False)
-        current = data[int(sys.argv[1])]
+        current = load_entry(int(sys.argv[1]))
 
         print(current.key)
         for i, dialog in enumerate(current.dialog):
@@ -0,0 +1,108 @@
+""" Renders Graphviz dot files on a bounded pool of worker threads
+
+The dot binary does the work in its own process, so threads are enough to keep every core busy. A renderer
+is any callable renderer(dot_path, out_path, format), the default one runs the local dot binary.
+"""
+
+import concurrent.futures
+import os
+import subprocess
+import threading
+
+MAX_WORKERS = os.cpu_count() or 4
+# requires ~graphviz-2.38\release\bin to be in PATH
+DOT_COMMAND = 'dot'
+# 'dot' skips rendering and gives back the dot file itself
+FORMATS = ['png', 'svg', 'dot']
+
+_pool = None
+_lock = threading.Lock()
+
+
+def render_dot(dot_path, out_path, format):
+    """ Renders a dot file with the Graphviz dot binary """
+
+    subprocess.run([DOT_COMMAND, '-T' + format, dot_path, '-o', out_path], check=True)
+
+
+def output_path(dot_path, format):
+    """ Returns the path a dot file is rendered to in the given format """
+
+    if (format == 'dot'):
+        return dot_path
+    return os.path.splitext(dot_path)[0] + '.' + format
+
+
+class RenderPool:
+    def __init__(self, max_workers=MAX_WORKERS, renderer=render_dot):
+        self.renderer = renderer
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    def _render(self, dot_path, format):
+        out_path = output_path(dot_path, format)
+        if (format != 'dot'):
+            # rendered next to the output and moved in place so readers never see a partial file
+            tmp_path = out_path + '.' + str(threading.get_ident()) + '.tmp'
+            self.renderer(dot_path, tmp_path, format)
+            os.replace(tmp_path, out_path)
+        return out_path
+
+    def _finished(self, out_path, future):
+        with self._lock:
+            if (self._pending.get(out_path) is future):
+                del self._pending[out_path]
+
+    def submit(self, dot_path, format='png'):
+        """ Queues a dot file for rendering, returns a future of the output path
+
+        A file that is already queued is not queued again, its pending future is returned instead
+        """
+
+        if (format not in FORMATS):
+            raise ValueError('Unknown format ' + str(format) + ', expected one of ' + ', '.join(FORMATS))
+
+        out_path = output_path(dot_path, format)
+        with self._lock:
+            future = self._pending.get(out_path)
+            if (future is None):
+                future = self.executor.submit(self._render, dot_path, format)
+                self._pending[out_path] = future
+                future.add_done_callback(lambda f: self._finished(out_path, f))
+            return future
+
+    def render(self, dot_paths, format='png'):
+        """ Renders many dot files concurrently, returns the output paths once all of them are done """
+
+        return wait([self.submit(dot_path, format) for dot_path in dot_paths])
+
+    def close(self):
+        """ Waits for the queued renders and stops the worker threads """
+
+        self.executor.shutdown(wait=True)
+
+
+def done(result):
+    """ Returns an already finished future, used for outputs that need no rendering """
+
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def wait(futures):
+    """ Returns the results of the futures in order, raising the first render error """
+
+    return [future.result() for future in futures]
+
+
+def get_pool():
+    """ Returns the shared render pool, starting it on first use """
+
+    global _pool
+
+    with _lock:
+        if (_pool is None):
+            _pool = RenderPool()
+    return _pool
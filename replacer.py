@@ -0,0 +1,115 @@
+""" Pluggable engines for the single-pass multiple string replacement used by parse.replace_bad_words
+
+Running this file reports the throughput of every engine on data.json, EX: 'py replacer.py [dictionary file]'
+"""
+
+import json
+import re
+import sys
+import time
+
+
+class RegexReplacer:
+    """ One alternation of every key in dictionary order, the first key that matches at a position wins """
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        # http://code.activestate.com/recipes/81330-single-pass-multiple-replace/
+        self.regex = re.compile("(%s)" % "|".join(map(re.escape, self.mapping.keys()))) if self.mapping else None
+
+    def replace(self, text):
+        if (self.regex is None):
+            return text
+        return self.regex.sub(lambda match: self.mapping[match.group()], text)
+
+
+class TrieReplacer(RegexReplacer):
+    """ Keys are merged into a prefix trie which is compiled to a regex, the longest key at a position wins
+
+    Each character of the text is tried against one trie branch instead of every key, so adding keys does not
+    add backtracking. The scan itself stays in the C regex engine, a Python-level Aho-Corasick walk is slower
+    for the dictionary sizes used here.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        trie = {}
+        for key in self.mapping:
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self.regex = re.compile(_trie_pattern(trie)) if self.mapping else None
+
+
+def _trie_pattern(node):
+    """ Returns the regex matching the longest key below a trie node, '' marks the end of a key """
+
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char != '']
+    if (len(alternatives) == 0):
+        return ''
+    if (len(alternatives) == 1 and '' not in node):
+        return alternatives[0]
+
+    # children are tried first so longer keys win, the ? lets the key end at this node
+    return '(?:' + '|'.join(alternatives) + ')' + ('?' if '' in node else '')
+
+
+ENGINES = {
+    'regex': RegexReplacer,
+    'trie': TrieReplacer
+}
+
+
+def build(mapping, engine='trie'):
+    """ Returns a replacer for the mapping using the named engine """
+
+    return ENGINES[engine](mapping)
+
+
+def load_dictionary(path):
+    """ Loads a replacement dictionary from a json object or from lines of 'old<tab>new', # starts a comment """
+
+    if (path.endswith('.json')):
+        with open(path) as file:
+            return json.load(file)
+
+    mapping = {}
+    with open(path) as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if (line.strip() == '' or line.startswith('#')):
+                continue
+            old, new = line.split('\t', 1)
+            mapping[old] = new
+    return mapping
+
+
+def throughput(replacer, texts, repeat=5):
+    """ Returns the replacement throughput over the texts in MB/s """
+
+    size = sum(len(text.encode('utf-8')) for text in texts) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            replacer.replace(text)
+    return size / (time.perf_counter() - start) / 1e6
+
+
+if (__name__ == '__main__'):
+    import parse
+
+    mapping = dict(parse.REPLACE_DICT)
+    if (len(sys.argv) == 2):
+        mapping.update(load_dictionary(sys.argv[1]))
+
+    texts = []
+    for entry in parse.iter_json(parse.JSON_FILE_PATH):
+        texts += [entry['Dialog'], entry['Summary']]
+
+    expected = [build(mapping, 'regex').replace(text) for text in texts]
+    for name in sorted(ENGINES):
+        replacer = build(mapping, name)
+        identical = [replacer.replace(text) for text in texts] == expected
+        print(name + ': ' + str(round(throughput(replacer, texts), 2)) + ' MB/s with ' + str(len(mapping)) +
+              ' keys' + ('' if identical else ' (OUTPUT DIFFERS FROM regex)'))
@@ -1,12 +1,273 @@
 """ Runs a flask local server to view the conversations, summaries, and generated KGs"""
 
-from flask import Flask, jsonify, render_template
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+
+from flask import Flask, Response, jsonify, render_template, request
 import parse
 from parse import Entry
 import generatekgs
-data = parse.parse()
+import kg
+
+KG_WORKERS = 2  # processes generating KGs, so request threads never wait on the extractors
+KG_FORMAT = 'png'
+# fields of the /conversations batch endpoint, eres are the triples of the conversation KG and the five summary KGs
+FIELDS = ['key', 'dialog', 'summaries', 'eres']
+DEFAULT_FIELDS = ['key', 'dialog', 'summaries']
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+app = Flask(__name__, static_url_path = "/" + generatekgs.KG_PATH, static_folder = generatekgs.KG_PATH)
+
+_data = None
+_data_lock = threading.Lock()
+_kg_pool = None
+_jobs = {}  # job ID to job record
+_job_ids = {}  # (KG directory, format) to the ID of the job generating it
+_futures = {}
+_jobs_lock = threading.RLock()
+_eres = {}  # (entry ID, extractor) to the triples of the entry's KGs
+_eres_futures = {}  # (entry ID, extractor) to the KG worker job writing the entry's KG artifacts
+
+
+def get_data():
+    """ Returns the corpus, loaded once on first use and shared by every request """
+
+    global _data
+
+    with _data_lock:
+        if (_data is None):
+            _data = parse.parse()
+    return _data
+
+
+def get_kg_pool():
+    """ Returns the KG worker processes, started on first use """
+
+    global _kg_pool
+
+    with _jobs_lock:
+        if (_kg_pool is None):
+            _kg_pool = concurrent.futures.ProcessPoolExecutor(max_workers=KG_WORKERS)
+    return _kg_pool
+
+
+def submit_kg_work(function, *args):
+    """ Runs a call on the KG workers, returns its future
+
+    A worker that died (killed for memory or crashed) breaks the whole pool, it is then replaced once
+    """
+
+    global _kg_pool
+
+    pool = get_kg_pool()
+    try:
+        return pool.submit(function, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        with _jobs_lock:
+            # another request may have replaced it already
+            if (_kg_pool is pool):
+                _kg_pool = None
+        pool.shutdown(wait=False)
+        return get_kg_pool().submit(function, *args)
+
+
+def urls(paths):
+    """ Returns the static URLs of artifact paths """
+
+    return ['/' + path.replace(os.sep, '/') for path in paths]
+
+
+def job_status(job_id):
+    """ Returns the JSON record of a job, None for an unknown ID """
+
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if (job is None):
+            return None
+        job = dict(job)
+        future = _futures.get(job_id)
+    if (job['status'] == 'queued' and future is not None and future.running()):
+        job['status'] = 'running'
+    return job
+
+
+def finish_job(job_id, future):
+    with _jobs_lock:
+        job = _jobs[job_id]
+        try:
+            job['urls'] = urls(future.result())
+            job['status'] = 'done'
+        except Exception as e:
+            job['status'] = 'error'
+            job['error'] = True
+            job['message'] = str(e)
+        del _futures[job_id]
+
+
+def submit_kg_job(id, extractor='chunk', format=KG_FORMAT):
+    """ Queues the KG generation of a conversation, returns the job's ID
+
+    A conversation whose KGs are queued, running or done keeps its job, finished KGs on disk are a done job
+    right away. Failed jobs are retried on the next submit.
+    """
+
+    entry = get_data()[id]
+    key = (generatekgs.kg_directory(entry, extractor), format)
+    with _jobs_lock:
+        job_id = _job_ids.get(key)
+        if (job_id is not None and _jobs[job_id]['status'] != 'error'):
+            return job_id
+
+        job_id = uuid.uuid4().hex
+        job = {'job': job_id, 'conversation': id, 'status': 'queued', 'urls': [], 'error': False}
+        future = None
+        paths = generatekgs.cached_kgs(entry, format, extractor)
+        if (paths is not None):
+            job['urls'] = urls(paths)
+            job['status'] = 'done'
+        else:
+            try:
+                # the worker gets the loaded entry, it neither reads the corpus nor blocks a request thread
+                future = submit_kg_work(generatekgs.generate_kgs_entry, entry, format, True, extractor)
+            except Exception as e:
+                # a job that never reached the workers is failed, so the next submit retries it
+                job['status'] = 'error'
+                job['error'] = True
+                job['message'] = str(e)
+
+        _jobs[job_id] = job
+        _job_ids[key] = job_id
+        if (future is not None):
+            _futures[job_id] = future
+            future.add_done_callback(functools.partial(finish_job, job_id))
+    return job_id
+
+
+@functools.lru_cache(maxsize=None)
+def conversation_json(id):
+    return json.dumps({'data': get_data()[id].dialog_raw, 'error': False})
+
+
+@functools.lru_cache(maxsize=None)
+def summary_json(id):
+    return json.dumps({'data': get_data()[id].summaries, 'error': False})
+
+
+def submit_eres(ids, extractor='chunk'):
+    """ Queues the KG artifacts of every entry whose triples are not cached yet, they are written concurrently """
+
+    with _jobs_lock:
+        for id in ids:
+            key = (id, extractor)
+            if (key not in _eres and key not in _eres_futures):
+                _eres_futures[key] = submit_kg_work(generatekgs.cached_dots, get_data()[id], extractor)
+
+
+def eres_cached(ids, extractor='chunk'):
+    """ Returns True if the triples of every entry are cached """
+
+    with _jobs_lock:
+        return all((id, extractor) in _eres for id in ids)
+
+
+def entry_eres(id, extractor='chunk'):
+    """ Returns the triples of an entry's six KGs, read from the cached KG artifacts """
+
+    key = (id, extractor)
+    # artifacts that are not cached yet are written on the KG workers
+    submit_eres([id], extractor)
+    with _jobs_lock:
+        if (key in _eres):
+            return _eres[key]
+        future = _eres_futures[key]
+
+    try:
+        eres = [[list(triple) for triple in kg.load(generatekgs.graph_path(path)).triples()]
+                for path in future.result()]
+    except Exception:
+        # failures are not cached, the next request retries
+        with _jobs_lock:
+            if (_eres_futures.get(key) is future):
+                del _eres_futures[key]
+        raise
+    with _jobs_lock:
+        _eres[key] = eres
+        if (_eres_futures.get(key) is future):
+            del _eres_futures[key]
+    return eres
+
+
+@functools.lru_cache(maxsize=None)
+def entry_etag(id):
+    """ Returns a hash of the text of an entry """
+
+    entry = get_data()[id]
+    return hashlib.sha1(json.dumps([entry.key, entry.dialog_raw, entry.summaries]).encode('utf-8')).hexdigest()
+
+
+def entry_fields(id, fields, extractor='chunk'):
+    """ Returns the requested fields of an entry as a JSON serializable dict """
+
+    entry = get_data()[id]
+    item = {'id': id}
+    if ('key' in fields):
+        item['key'] = entry.key
+    if ('dialog' in fields):
+        item['dialog'] = entry.dialog_raw
+    if ('summaries' in fields):
+        item['summaries'] = entry.summaries
+    if ('eres' in fields):
+        try:
+            item['eres'] = entry_eres(id, extractor)
+        except Exception:
+            item['eres'] = []
+            item['error'] = True
+    return item
+
+
+def page_etag(ids, fields, extractor='chunk'):
+    """ Returns the ETag of a page, it changes with the entries' text, the fields and, for eres, the extractor """
+
+    sha = hashlib.sha1(json.dumps([ids, fields]).encode('utf-8'))
+    if ('eres' in fields):
+        sha.update(generatekgs.extractor_hash(extractor).encode('utf-8'))
+    for id in ids:
+        sha.update(entry_etag(id).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def stream_page(ids, fields, header, footer, compress=False):
+    """ Yields the JSON of a page one entry at a time, gzip compressed if compress is set """
+
+    def chunks():
+        error = False
+        yield json.dumps(header)[:-1] + ', "items": ['
+        for i, id in enumerate(ids):
+            item = entry_fields(id, fields)
+            error = error or item.get('error', False)
+            yield (', ' if i > 0 else '') + json.dumps(item)
+        yield '], ' + json.dumps(dict(footer, error=error))[1:]
+
+    if (not compress):
+        for chunk in chunks():
+            yield chunk.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks():
+        data = compressor.compress(chunk.encode('utf-8'))
+        if (data):
+            yield data
+    yield compressor.flush()
 
-app = Flask(__name__, static_url_path = "/graphs", static_folder = "graphs")
 
 # Route to get the index HTML page
 @app.route('/', methods = ['GET'])
@@ -17,7 +278,7 @@ def index():
 @app.route('/conversation/<int:id>', methods = ['GET'])
 def getConversation(id):
     try:
-        return jsonify({'data': data[id].dialog_raw, 'error': False})
+        return app.response_class(conversation_json(id), mimetype = 'application/json')
     except:
         return jsonify({'data': [], 'error': True})
 
@@ -25,19 +286,92 @@ def getConversation(id):
 @app.route('/summary/<int:id>', methods = ['GET'])
 def getSummary(id):
     try:
-        return jsonify({'data': data[id].summaries, 'error': False})
+        return app.response_class(summary_json(id), mimetype = 'application/json')
     except:
         return jsonify({'data': [], 'error': True})
 
-# Route to generate the KGs for the desired conversation
+# Route to generate the KGs for the desired conversation, waits for the KG job to finish
 @app.route('/kgs/<int:id>', methods = ['GET'])
 def getKgs(id):
     try:
-        generatekgs.generate_kgs(id)
-        return jsonify({'error': False})
+        job_id = submit_kg_job(id)
+        with _jobs_lock:
+            future = _futures.get(job_id)
+        if (future is not None):
+            # the done callback may not have updated the job yet, so the reply is taken from the future itself
+            return jsonify({'urls': urls(future.result()), 'error': False})
+        job = job_status(job_id)
+        return jsonify({'urls': job['urls'], 'error': job['error']})
     except:
-        return jsonify({'error': True})
+        return jsonify({'urls': [], 'error': True})
+
+# Route to queue the KGs of the desired conversation, poll the returned job with /jobs/<job>
+@app.route('/kgs/<int:id>/jobs', methods = ['POST'])
+def postKgJob(id):
+    try:
+        return jsonify(job_status(submit_kg_job(id))), 202
+    except:
+        return jsonify({'job': None, 'conversation': id, 'status': 'error', 'urls': [], 'error': True}), 400
+
+# Route to return the status and, once done, the KG urls of a job
+@app.route('/jobs/<job_id>', methods = ['GET'])
+def getJob(job_id):
+    job = job_status(job_id)
+    if (job is None):
+        return jsonify({'job': job_id, 'status': 'unknown', 'urls': [], 'error': True}), 404
+    return jsonify(job)
+
+# Route to return a page of conversations, ?start=&count= pages over the corpus, ?ids=1,2,3 picks entries and
+# ?fields=key,dialog,summaries,eres picks what each entry holds
+@app.route('/conversations', methods = ['GET'])
+def getConversations():
+    total = len(get_data())
+    try:
+        fields = request.args.get('fields', ','.join(DEFAULT_FIELDS)).split(',')
+        if (any(field not in FIELDS for field in fields)):
+            raise ValueError('Unknown field, expected some of ' + ','.join(FIELDS))
+        if ('ids' in request.args):
+            ids = [int(id) for id in request.args['ids'].split(',') if id != '']
+            if (any(id < 0 or id >= total for id in ids)):
+                raise ValueError('Conversation out of range')
+            start, next_start = None, None
+        else:
+            start = request.args.get('start', 0, type=int)
+            count = min(request.args.get('count', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+            # a count of 0 would hand out its own start as the next page forever
+            if (start < 0 or count < 1):
+                raise ValueError('start must be 0 or more and count 1 or more')
+            ids = list(range(start, min(start + count, total)))
+            next_start = start + count if start + count < total else None
+    except ValueError as e:
+        return jsonify({'items': [], 'error': True, 'message': str(e)}), 400
+
+    # the quality is 0 for an encoding that is missing or refused with gzip;q=0
+    compress = request.accept_encodings['gzip'] > 0
+    # a page with pending or failed triples may change on the next request, so it is only tagged once every
+    # entry's triples are cached
+    etag = None
+    if ('eres' not in fields or eres_cached(ids)):
+        # the gzip body is a different representation and gets its own tag
+        etag = page_etag(ids, fields) + ('-gzip' if compress else '')
+        if (etag in request.if_none_match):
+            response = Response(status = 304)
+            response.set_etag(etag)
+            return response
+
+    if ('eres' in fields):
+        # every entry of the page is queued up front, the stream then collects them in order
+        submit_eres(ids)
+    header = {'start': start, 'total': total, 'fields': fields}
+    footer = {'next': next_start, 'error': False}
+    response = Response(stream_page(ids, fields, header, footer, compress), mimetype = 'application/json')
+    if (etag is not None):
+        response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if (compress):
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 if __name__ == '__main__':
     port = 8000
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,131 @@
+""" Vectorized scoring of summary EREs against the dialog turns of an entry
+
+EntryScorer builds the term-by-turn matrices of an entry once and scores every ERE of a summary with a single
+sparse matrix product. The arithmetic follows gensim's Dictionary, TfidfModel and SparseMatrixSimilarity step
+by step (term IDs, log2 idf, two L2 normalizations, float32 index) so the guesses equal evaluate's exactly.
+"""
+
+import collections
+
+import numpy
+import scipy.sparse
+
+EPS = 1e-12  # TfidfModel drops weights at or below this
+
+
+def tfidf_matrix(bows, idfs, num_terms, normalizations=2):
+    """ Returns the float32 tfidf vectors of bag-of-words rows as a sparse matrix, one row per bow """
+
+    rows = [[(id, count * idfs[id]) for id, count in bow if abs(idfs[id]) > EPS] for bow in bows]
+    width = max([len(row) for row in rows] + [1])
+
+    # rows are padded with zeros, adding a zero leaves gensim's sequential sum of squares unchanged
+    ids = numpy.zeros((len(rows), width), dtype=numpy.int64)
+    values = numpy.zeros((len(rows), width))
+    for r, row in enumerate(rows):
+        for c, (id, value) in enumerate(row):
+            ids[r, c] = id
+            values[r, c] = value
+
+    for n in range(normalizations):
+        squares = numpy.zeros(len(rows))
+        for c in range(width):
+            squares = squares + values[:, c] ** 2
+        lengths = numpy.sqrt(squares)
+        scale = (lengths != 0.0) & (lengths != 1.0)
+        values[scale] = values[scale] / lengths[scale, None]
+        if (n == 0):
+            values[numpy.abs(values) <= EPS] = 0.0
+
+    matrix = scipy.sparse.csr_matrix((values.astype(numpy.float32).ravel(), ids.ravel(),
+                                      numpy.arange(0, len(rows) * width + 1, width)),
+                                     shape=(len(rows), max(num_terms, 1)))
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def entry_arrays(texts):
+    """ Returns (tokens, idfs, tfidf index, term counts) of an entry's tokenized dialog turns
+
+    tokens lists the entry's tokens by term ID, the index and the counts are sparse turn by term matrices
+    """
+
+    # ids are handed out like gensim's Dictionary, new tokens of each turn in sorted order
+    token2id = {}
+    bows = []
+    for text in texts:
+        counter = collections.Counter(text)
+        for token in sorted(t for t in counter if t not in token2id):
+            token2id[token] = len(token2id)
+        bows.append(sorted((token2id[token], count) for token, count in counter.items()))
+
+    dfs = collections.Counter(id for bow in bows for id, _ in bow)
+    idfs = numpy.zeros(len(token2id))
+    for id, df in dfs.items():
+        idfs[id] = numpy.log(float(len(texts)) / df) / numpy.log(2.0)
+
+    # the index normalizes the already normalized tfidf vectors once more
+    index = tfidf_matrix(bows, idfs, len(token2id), normalizations=2)
+
+    counts = scipy.sparse.csr_matrix(([count for bow in bows for _, count in bow],
+                                      [id for bow in bows for id, _ in bow],
+                                      numpy.cumsum([0] + [len(bow) for bow in bows])),
+                                     shape=(len(texts), max(len(token2id), 1)), dtype=numpy.int64)
+    return sorted(token2id, key=token2id.get), idfs, index, counts
+
+
+class EntryScorer:
+    def __init__(self, texts, rarewords, arrays=None):
+        """ texts are the tokenized dialog turns, rarewords the set of corpus-wide rare tokens
+
+        arrays are the precomputed entry_arrays of the texts, texts is not used when they are given
+        """
+
+        tokens, self.idfs, self.index, self.term_counts = arrays or entry_arrays(texts)
+        self.token2id = {token: id for id, token in enumerate(tokens)}
+        self.num_turns = self.index.shape[0]
+        self.num_terms = len(tokens)
+        self.is_rare = numpy.array([token in rarewords for token in tokens] + [False], dtype=bool)
+
+    def bows(self, token_lists):
+        """ Returns the bag-of-words of each token list, tokens that are not in the dialog are dropped """
+
+        bows = []
+        for tokens in token_lists:
+            counter = collections.Counter(token for token in tokens if token in self.token2id)
+            bows.append(sorted((self.token2id[token], count) for token, count in counter.items()))
+        return bows
+
+    def tfidf_scores(self, token_lists):
+        """ Returns the tfidf similarity of each token list to each turn, divided by the list's best score """
+
+        queries = tfidf_matrix(self.bows(token_lists), self.idfs, self.num_terms).T.tocsc()
+        sims = self.index.dot(queries).toarray().T
+        largest = sims.max(axis=1) if self.num_turns > 0 else numpy.zeros(len(token_lists), dtype=numpy.float32)
+        largest[largest == 0] = 1
+        return sims / largest[:, None]
+
+    def rareword_scores(self, token_lists):
+        """ Returns how often the rare tokens of each token list occur in each turn, divided by the largest count """
+
+        present = numpy.zeros((max(self.num_terms, 1), len(token_lists)), dtype=numpy.int64)
+        for e, tokens in enumerate(token_lists):
+            for token in set(tokens):
+                id = self.token2id.get(token)
+                if (id is not None and self.is_rare[id]):
+                    present[id, e] = 1
+        counts = numpy.asarray(self.term_counts.dot(present)).T
+        largest = counts.max(axis=1) if self.num_turns > 0 else numpy.zeros(len(token_lists), dtype=numpy.int64)
+        largest[largest == 0] = 1
+        return counts / largest[:, None]
+
+    def guesses(self, token_lists, weights, spacy_values=None):
+        """ Returns the index of the best matching turn for each token list, ties go to the first turn """
+
+        rarewords_weight, tfidf_weight, spacy_weight = weights
+        # the float32 tfidf scores are widened before weighting, as in evaluate.make_ere_guess
+        scores = rarewords_weight * self.rareword_scores(token_lists)
+        scores = scores + tfidf_weight * self.tfidf_scores(token_lists).astype(numpy.float64)
+        if (spacy_values is not None):
+            scores = scores + spacy_weight * spacy_values
+        return scores.argmax(axis=1).tolist()
@@ -0,0 +1,295 @@
+""" Sweeps the weights of evaluate's alignment scorer without re-running the pipeline for every setting
+
+The per-ERE feature scores and the sentence structure of every summary are computed once and cached on disk.
+A weight setting is then scored with array arithmetic only, many settings at a time, and gives the same
+accuracy evaluate.evaluate prints for it, including its Counter quirks: turn votes and label bonuses are kept
+under different keys, votes carry over between the sentences of a summary and ties go to the first key added.
+"""
+
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import pickle
+import sys
+
+import numpy
+from nltk import word_tokenize
+
+import embeddings
+import evalindex
+import evaluate
+import generatekgs
+import parse
+import scorer
+
+# rarewords, tfidf and spacy weights of make_ere_guess, the ERE vote and the label count and label order bonuses
+PARAMETERS = ['rarewords', 'tfidf', 'spacy', 'vote', 'label', 'order']
+GRID = {
+    'rarewords': [round(0.1 * i, 1) for i in range(0, 11)],
+    'tfidf': [round(0.1 * i, 1) for i in range(0, 11)],
+    'spacy': [0, 0.2, 0.5],
+    'vote': [1, 5, 10],
+    'label': [0, 1, 2],
+    'order': [0, 1, 2],
+}
+RANGES = {'rarewords': (0, 1), 'tfidf': (0, 1), 'spacy': (0, 1), 'vote': (0, 10), 'label': (0, 2), 'order': (0, 2)}
+BATCH_SIZE = 1000  # settings scored together, bounds the size of the score arrays
+CACHE_PATH = 'cache'
+
+
+class SummaryFeatures:
+    def __init__(self, rarewords_scores, tfidf_scores, spacy_scores, label_values, order_values, steps, count,
+                 random_increments):
+        """ Scores are ERE by dialog turn arrays, steps replay evaluate's loop over the EREs of the summary
+
+        A step is ('vote', ERE index) or ('close', set of correct turns) for a sentence that check_correct scores
+        """
+
+        self.rarewords_scores = rarewords_scores
+        self.tfidf_scores = tfidf_scores
+        self.spacy_scores = spacy_scores
+        self.label_values = label_values
+        self.order_values = order_values
+        self.steps = steps
+        self.count = count
+        self.random_increments = random_increments
+
+
+def summary_steps(entry, triples):
+    """ Returns (steps, evaluated sentence count, random guess increments) of one summary's EREs
+
+    Follows the sentence bookkeeping of evaluate.evaluate_entry, none of it depends on the weights
+    """
+
+    steps, random_increments = [], []
+    ere_count, sentence_count, unmatched_sentences = 0, 0, 0
+
+    def close():
+        nonlocal ere_count, sentence_count, unmatched_sentences
+        # sentence has no matches
+        if (str(sentence_count) not in entry.summary_to_dialog[1]):
+            sentence_count += 1
+            unmatched_sentences += 1
+        elif (ere_count > 0):
+            correct_dialog = entry.summary_to_dialog[1][str(sentence_count)]
+            steps.append(('close', correct_dialog))
+            random_increments.append(0.0 + len(correct_dialog) / len(entry.dialog))
+            sentence_count += 1
+            ere_count = 0
+
+    for e, ere in enumerate(triples):
+        if (str(sentence_count) != str(ere[0])):  # done evaluating eres for a sentence
+            close()
+        steps.append(('vote', e))
+        ere_count += 1
+    close()
+
+    return steps, sentence_count - unmatched_sentences, random_increments
+
+
+def entry_features(entry, id, rarewords, in_memory=False, extractor='chunk', eval_index=None):
+    """ Returns the SummaryFeatures of an entry's five summaries """
+
+    graphs = evaluate.summary_graphs(entry, in_memory, extractor)
+    if (eval_index is not None):
+        entry_scorer = eval_index.scorer(entry, rarewords)
+    else:
+        entry_scorer = scorer.EntryScorer([list(word_tokenize(dialog.lower())) for dialog in entry.dialog],
+                                          rarewords)
+    label_values, order_values = evaluate.calc_labels(entry)
+    similarities = embeddings.similarities(entry)
+
+    features = []
+    for j in range(0, 5):
+        triples = list(graphs[j].triples())
+        ere_tokens = [evaluate.tokenize_ere(ere) for ere in triples]
+        # the float32 tfidf scores are widened like in scorer.EntryScorer.guesses
+        tfidf_scores = entry_scorer.tfidf_scores(ere_tokens).astype(numpy.float64)
+        steps, count, random_increments = summary_steps(entry, triples)
+        features.append(SummaryFeatures(entry_scorer.rareword_scores(ere_tokens), tfidf_scores,
+                                        embeddings.sentence_values(similarities[j], triples),
+                                        numpy.array(label_values, dtype=float),
+                                        numpy.array(order_values, dtype=float), steps, count, random_increments))
+    return features
+
+
+def features_hash(data, ids, rarewords, in_memory, extractor):
+    """ Returns a hash of everything the cached features depend on """
+
+    sha = hashlib.sha1((extractor + str(in_memory) + generatekgs.extractor_hash(extractor) +
+                        evalindex.TOKENIZER).encode('utf-8'))
+    for function in [SummaryFeatures, summary_steps, entry_features, evaluate.summary_graphs, evaluate.calc_labels,
+                     evaluate.tokenize_ere]:
+        sha.update(inspect.getsource(function).encode('utf-8'))
+    for module in [scorer, embeddings]:
+        sha.update(inspect.getsource(module).encode('utf-8'))
+    sha.update(embeddings.model_id().encode('utf-8'))
+    sha.update(json.dumps(sorted(rarewords)).encode('utf-8'))
+    for id in ids:
+        entry = data[id]
+        sha.update(json.dumps([id, entry.key, entry.dialog, entry.summaries, entry.summaries_sentences,
+                               entry.summary_to_dialog], default=sorted).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def load_features(data, rarewords, start, stop, in_memory=False, extractor='chunk', eval_index=None,
+                  refresh=False):
+    """ Returns the SummaryFeatures of every summary of the entries in [start, stop), cached in CACHE_PATH """
+
+    ids = list(range(len(data)))[start:stop]
+    path = os.path.join(CACHE_PATH, 'sweep-' + features_hash(data, ids, rarewords, in_memory, extractor)[:16] +
+                        '.pkl')
+    if (not refresh and os.path.isfile(path)):
+        print('Reading sweep features from "' + path + '"')
+        with open(path, 'rb') as file:
+            return [SummaryFeatures(**summary) for summary in pickle.load(file)]
+
+    # embeds every entry missing from the cache in one batch
+    embeddings.entry_embeddings([data[id] for id in ids])
+    features = []
+    for id in ids:
+        print('Entry : ' + str(id))
+        features += entry_features(data[id], id, rarewords, in_memory, extractor, eval_index)
+
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    # written next to the cache file and moved in place once complete, as plain dicts so the file does not
+    # depend on the module sweep was run as
+    with open(path + '.' + str(os.getpid()) + '.tmp', 'wb') as file:
+        pickle.dump([vars(summary) for summary in features], file, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.' + str(os.getpid()) + '.tmp', path)
+    print('Saved sweep features to "' + path + '"')
+    return features
+
+
+def summary_correct(summary, settings):
+    """ Returns the correct sentence count of one summary for each row of a settings array """
+
+    count = len(settings)
+    turns = len(summary.label_values)
+    sentence_correct = numpy.zeros(count)
+    if (not summary.steps):
+        return sentence_correct
+
+    weights = settings[:, :, None, None]
+    scores = weights[:, 0] * summary.rarewords_scores
+    scores = scores + weights[:, 1] * summary.tfidf_scores
+    scores = scores + weights[:, 2] * summary.spacy_scores
+    guesses = scores.argmax(axis=2)
+    bonus = settings[:, 4, None] * summary.label_values + settings[:, 5, None] * summary.order_values
+
+    # the Counter of evaluate holds turn votes under str keys [0, turns) and label bonuses under int keys
+    # [turns, 2 * turns), only str keys can be correct, order holds when each key was added
+    values = numpy.zeros((count, 2 * turns))
+    order = numpy.full((count, 2 * turns), numpy.inf)
+    added = numpy.zeros(count)
+    rows = numpy.arange(count)
+    labels_added = False
+    for step, value in summary.steps:
+        if (step == 'vote'):
+            guess = guesses[:, value]
+            new = order[rows, guess] == numpy.inf
+            order[rows[new], guess[new]] = added[new]
+            added += new
+            values[rows, guess] += settings[:, 3]
+            continue
+
+        values[:, turns:] += bonus
+        if (not labels_added):
+            order[:, turns:] = added[:, None] + numpy.arange(turns)
+            added += turns
+            labels_added = True
+
+        correct = numpy.zeros(2 * turns, dtype=bool)
+        correct[[int(turn) for turn in value if int(turn) < turns]] = True
+        present = numpy.where(order == numpy.inf, -numpy.inf, values)
+        tied = present == present.max(axis=1)[:, None]
+        first = numpy.where(tied, order, numpy.inf).argmin(axis=1)
+        tied_correct = (tied & correct).sum(axis=1)
+        fraction = tied_correct / tied.sum(axis=1)
+        sentence_correct += numpy.where(correct[first], 1.0, numpy.where(tied_correct > 0, fraction, 0.0))
+    return sentence_correct
+
+
+def sweep(features, settings, batch_size=BATCH_SIZE):
+    """ Returns (evaluated sentence count, correct sentence count of each setting, random guess score)
+
+    settings is a settings by PARAMETERS array, counts are summed in the order evaluate.evaluate sums them
+    """
+
+    settings = numpy.asarray(settings, dtype=float)
+    total_evaluated, random_correct = 0, 0.0
+    for summary in features:
+        total_evaluated += summary.count
+        for random_increment in summary.random_increments:
+            random_correct += random_increment
+
+    total_correct = numpy.zeros(len(settings))
+    for begin in range(0, len(settings), batch_size):
+        batch = settings[begin:begin + batch_size]
+        for summary in features:
+            total_correct[begin:begin + batch_size] += summary_correct(summary, batch)
+    return total_evaluated, total_correct, random_correct
+
+
+def grid_settings(grid=None):
+    """ Returns every combination of the grid's values as a settings array """
+
+    grid = grid or GRID
+    return numpy.array(list(itertools.product(*[grid[name] for name in PARAMETERS])), dtype=float)
+
+
+def random_settings(count, ranges=None, seed=0):
+    """ Returns count settings drawn uniformly from the ranges """
+
+    ranges = ranges or RANGES
+    rng = numpy.random.RandomState(seed)
+    return numpy.column_stack([rng.uniform(ranges[name][0], ranges[name][1], count) for name in PARAMETERS])
+
+
+def default_settings():
+    """ Returns the settings evaluate currently uses """
+
+    return numpy.array([list(evaluate.WEIGHTS) + [evaluate.VOTE_WEIGHT] + list(evaluate.LABEL_WEIGHTS)], dtype=float)
+
+
+def report(settings, total_evaluated, total_correct, random_correct, top=None):
+    """ Prints the accuracy of every setting, best first, top limits the number of rows """
+
+    order = numpy.argsort(-total_correct, kind='stable')
+    print(' '.join(PARAMETERS) + ' correct percent')
+    for row in order[:top]:
+        print(' '.join('%g' % value for value in settings[row]) + ' ' + str(total_correct[row]) + ' ' +
+              str(total_correct[row] / total_evaluated))
+    print('count:' + str(total_evaluated) + ' settings:' + str(len(settings)) +
+          ' random: ' + str(random_correct / total_evaluated))
+
+
+if (__name__ == '__main__'):
+    # --in-memory builds the features straight from the extractor, --random N samples N settings instead of the
+    # grid, --top N only prints the N best settings, --refresh recomputes the cached features
+    options = {}
+    for flag in ['--random', '--top']:
+        if (flag in sys.argv):
+            position = sys.argv.index(flag)
+            options[flag] = int(sys.argv[position + 1])
+            del sys.argv[position:position + 2]
+    for flag in ['--in-memory', '--refresh']:
+        options[flag] = flag in sys.argv
+        if (options[flag]):
+            sys.argv.remove(flag)
+
+    if (len(sys.argv) != 3):
+        print("Please run command with desired conversation/summary range ID, "
+              "EX: 'py sweep.py 0 44 [--random N] [--top N] [--in-memory] [--refresh]'")
+    elif (int(sys.argv[1]) < 0 or int(sys.argv[1]) > 45 or int(sys.argv[2]) < 0 or int(sys.argv[2]) > 45):
+        print("Argument/s out of range (0,45)")
+    else:
+        data = parse.parse()
+        eval_index = evalindex.load(data)
+        rarewords = evaluate.calc_rarewords(data, eval_index=eval_index)
+        features = load_features(data, rarewords, int(sys.argv[1]), int(sys.argv[2]), options['--in-memory'],
+                                 eval_index=eval_index, refresh=options['--refresh'])
+        settings = random_settings(options['--random']) if '--random' in options else grid_settings()
+        report(settings, *sweep(features, settings), top=options.get('--top'))